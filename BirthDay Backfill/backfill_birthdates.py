@@ -4,16 +4,17 @@ backfill_birthdates_diag_v5.py
 ──────────────────────
 Populate dbo.BirthDates for every voter who is still missing a BirthDate.
 (v5: T-SQL returns total counts via SELECT statement for reliability)
-Runs completely inside SQL Server in batches.
+Runs completely inside SQL Server in batches, split across parallel Id ranges.
 """
 
 import os
 import sys
-import textwrap
 import pyodbc
 from dotenv import load_dotenv
 import logging
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from script_support import setup_logging
 
 # ── 0.  LOGGING SETUP ───────────────────────────────────────────────────
 log_file_name = f"backfill_birthdates_diag_v5_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
@@ -21,14 +22,7 @@ log_file_full_path = os.path.join(os.getcwd(), log_file_name)
 
 print(f"--- Python script: Will attempt to create log file at: {log_file_full_path} ---")
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(log_file_full_path, encoding='utf-8'),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+setup_logging(log_file_full_path)
 
 # ── 1.  CONNECTION DETAILS ──────────────────────────────────────────────
 DB_DRIVER   = '{ODBC Driver 17 for SQL Server}'
@@ -53,163 +47,111 @@ CONN_STR = (
 
 # ── 2.  THE SET-BASED, BATCHED T-SQL (Returns Counts via SELECT) ──
 BATCH_SIZE = 100_000
+PARALLEL_WORKERS = 4      # concurrent connections, each backfilling its own Id range
+MAX_DURATION_SECONDS = 1800   # per-range wall-clock cap; a capped range resumes on the next run
+MAX_BATCHES = 100_000         # per-range batch-count cap
+
+# Runs once before the workers start: index setup + the Id keyspace to partition.
+TSQL_PREPARE = f"""
+USE {DB_DATABASE};
+
+-- One-time: filtered index so each batch seeks straight to the remaining NULL rows
+IF NOT EXISTS (SELECT 1 FROM sys.indexes
+               WHERE name = 'IX_BirthDates_NullBirthDate' AND object_id = OBJECT_ID('dbo.BirthDates'))
+    CREATE NONCLUSTERED INDEX IX_BirthDates_NullBirthDate
+        ON dbo.BirthDates (Id)
+        WHERE BirthDate IS NULL;
+
+-- One-time: persisted "IDNumber starts with six digits" flag, indexed as (flag, Id), so
+-- the candidate scan is a range seek instead of a character-class LIKE on every row.
+-- (Filtered-index predicates can use neither LIKE nor computed columns, hence the key.)
+IF COL_LENGTH('dbo.MasterItems', 'IsNumericId6') IS NULL
+    ALTER TABLE dbo.MasterItems ADD IsNumericId6 AS
+        (CASE WHEN IDNumber LIKE '[0-9][0-9][0-9][0-9][0-9][0-9]%' THEN 1 ELSE 0 END) PERSISTED;
+IF NOT EXISTS (SELECT 1 FROM sys.indexes
+               WHERE name = 'IX_MasterItems_NumericId6' AND object_id = OBJECT_ID('dbo.MasterItems'))
+    EXEC('CREATE NONCLUSTERED INDEX IX_MasterItems_NumericId6
+              ON dbo.MasterItems (IsNumericId6, Id) INCLUDE (IDNumber);');
+
+SELECT MIN(Id) AS LoId, MAX(Id) AS HiId FROM dbo.MasterItems;
+"""
 
-TSQL = textwrap.dedent(f"""
-    USE {DB_DATABASE};
-    SET NOCOUNT ON;
-
-    DECLARE @BatchSize int = {BATCH_SIZE};
-    -- @pivotYY will be calculated inline
-
-    PRINT 'T-SQL: Starting v5 DIAGNOSTIC (counts via SELECT)'; -- This simple PRINT might still come through
-
-    ---------------------------------------------------------------
-    -- Phase 1: INSERT rows that don’t exist
-    ---------------------------------------------------------------
-    -- PRINT 'T-SQL: Starting INSERT Phase'; -- Minimal internal prints
-    DECLARE @i_v5 int = 1, @totalInserted_v5 int = 0;
-    WHILE @i_v5 > 0
-    BEGIN
-        SET IDENTITY_INSERT dbo.BirthDates ON;
-        INSERT INTO dbo.BirthDates (Id, MasterItemId, BirthDate)
-        SELECT TOP (@BatchSize)
-                mi.Id,
-                mi.Id,
-                TRY_CONVERT(date,
-                    CASE WHEN LEFT(mi.IDNumber,2) > RIGHT(CONVERT(char(4), YEAR(GETDATE())), 2)
-                         THEN '19'+LEFT(mi.IDNumber,6)
-                         ELSE '20'+LEFT(mi.IDNumber,6) END) AS DOB
-        FROM   dbo.MasterItems mi
-        LEFT   JOIN dbo.BirthDates bd ON bd.Id = mi.Id
-        WHERE  bd.Id IS NULL
-          AND  mi.IDNumber LIKE '[0-9][0-9][0-9][0-9][0-9][0-9]%'
-          AND  TRY_CONVERT(date,
-                CASE WHEN LEFT(mi.IDNumber,2) > RIGHT(CONVERT(char(4), YEAR(GETDATE())), 2)
-                     THEN '19'+LEFT(mi.IDNumber,6)
-                     ELSE '20'+LEFT(mi.IDNumber,6) END) IS NOT NULL
-        ORDER BY mi.Id;
-
-        SET @i_v5 = @@ROWCOUNT;
-        SET @totalInserted_v5 = @totalInserted_v5 + @i_v5;
-        SET IDENTITY_INSERT dbo.BirthDates OFF;
-
-        IF @i_v5 = 0 BEGIN BREAK; END
-    END
-    -- PRINT CONCAT('T-SQL: INSERT Phase finished. Total inserted in this run: ', @totalInserted_v5); -- Replaced by SELECT
-
-    ---------------------------------------------------------------
-    -- Phase 2: UPDATE rows whose BirthDate is still NULL
-    ---------------------------------------------------------------
-    -- PRINT 'T-SQL: Starting UPDATE Phase'; -- Minimal internal prints
-    DECLARE @u_v5 int = 1, @totalUpdated_v5 int = 0;
-    WHILE @u_v5 > 0
-    BEGIN
-        UPDATE bd
-        SET bd.BirthDate = TRY_CONVERT(date,
-                                CASE WHEN LEFT(mi.IDNumber,2) > RIGHT(CONVERT(char(4), YEAR(GETDATE())), 2)
-                                     THEN '19'+LEFT(mi.IDNumber,6)
-                                     ELSE '20'+LEFT(mi.IDNumber,6) END)
-        FROM dbo.BirthDates bd
-        JOIN (
-            SELECT TOP (@BatchSize)
-                    m.Id
-            FROM dbo.MasterItems m
-            JOIN dbo.BirthDates b ON b.Id = m.Id
-            WHERE b.BirthDate IS NULL
-              AND m.IDNumber LIKE '[0-9][0-9][0-9][0-9][0-9][0-9]%'
-              AND TRY_CONVERT(date,
-                    CASE WHEN LEFT(m.IDNumber,2) > RIGHT(CONVERT(char(4), YEAR(GETDATE())), 2)
-                         THEN '19'+LEFT(m.IDNumber,6)
-                         ELSE '20'+LEFT(m.IDNumber,6) END) IS NOT NULL
-            ORDER BY m.Id
-        ) AS todo ON todo.Id = bd.Id
-        JOIN dbo.MasterItems mi ON mi.Id = bd.Id;
-
-        SET @u_v5 = @@ROWCOUNT;
-        SET @totalUpdated_v5 = @totalUpdated_v5 + @u_v5;
-
-        IF @u_v5 = 0 BEGIN BREAK; END
-    END
-    -- PRINT CONCAT('T-SQL: UPDATE Phase finished. Total updated in this run: ', @totalUpdated_v5); -- Replaced by SELECT
-
-    -- PRINT 'T-SQL: v5 DIAGNOSTIC finished. Returning counts.'; -- Replaced by SELECT
-    SELECT @totalInserted_v5 AS TotalInsertedInRun, @totalUpdated_v5 AS TotalUpdatedInRun;
-""")
+# Runs once per worker; parameters are @BatchSize, the worker's inclusive @LoId / @HiId,
+# and the @MaxSeconds / @MaxBatches runaway guards. The procedure body lives in
+# migrations/usp_BackfillBirthDates.sql and must be deployed before the first run.
+TSQL = "{CALL dbo.usp_BackfillBirthDates(?, ?, ?, ?, ?)}"
+
+# Session options sent once per connection. With NOCOUNT on and no PRINTs in the
+# procedure, its trailing SELECT is the only thing pyodbc sees - no message draining needed.
+SESSION_SETUP = "SET NOCOUNT ON; SET ARITHABORT ON; SET ANSI_WARNINGS ON;"
 
 # ── 3.  RUN IT AND FETCH RESULTS ─────────────────────────────────
+def connect() -> pyodbc.Connection:
+    cn = pyodbc.connect(CONN_STR, autocommit=True)
+    cn.cursor().execute(SESSION_SETUP)
+    return cn
+
+
+def split_id_range(lo: int, hi: int, parts: int) -> list[tuple[int, int]]:
+    """Split the inclusive range [lo, hi] into at most `parts` contiguous, disjoint ranges."""
+    span = hi - lo + 1
+    parts = max(1, min(parts, span))
+    step = -(-span // parts)  # ceiling division
+    return [(start, min(start + step - 1, hi)) for start in range(lo, hi + 1, step)]
+
+
+def run_backfill_range(lo_id: int, hi_id: int) -> tuple[int, int]:
+    """Run the MERGE loop for Ids in [lo_id, hi_id] on its own connection; returns (inserted, updated)."""
+    # pyodbc releases the GIL while the ODBC call runs, so threads give real concurrency here.
+    with connect() as cn:
+        cur = cn.cursor()
+        logging.info(f"Range {lo_id}-{hi_id}: executing T-SQL block...")
+        row = cur.execute(TSQL, BATCH_SIZE, lo_id, hi_id, MAX_DURATION_SECONDS, MAX_BATCHES).fetchone()  # the procedure ends with a SELECT statement
+        if not row:
+            raise RuntimeError(f"Range {lo_id}-{hi_id}: T-SQL execution did not return a result row for counts.")
+        inserted, updated = row.TotalInsertedInRun, row.TotalUpdatedInRun
+        if row.StoppedEarly:
+            logging.warning(f"Range {lo_id}-{hi_id}: stopped after {row.BatchesDone} batch(es) at Id {row.LastProcessedId} "
+                            f"(MAX_DURATION_SECONDS / MAX_BATCHES cap); re-run to resume from there.")
+
+        logging.info(f"Range {lo_id}-{hi_id}: inserted {inserted}, updated {updated}.")
+        return inserted, updated
+
+
 if __name__ == "__main__":
     logging.info("Diagnostic script started (v5).")
     try:
         logging.info(f"Attempting to connect to DB: SERVER={DB_SERVER}, DATABASE={DB_DATABASE}, USER={DB_USER}")
-        with pyodbc.connect(CONN_STR, autocommit=True) as cn:
-            logging.info("Connected - running diagnostic back-fill (v5)...")
-            cur = cn.cursor()
-            
-            # The entire TSQL block is one logical statement for pyodbc if not split by "GO"
-            # Here, we expect it to be one block.
-            logging.info(f"Executing T-SQL block...")
-            try:
-                cur.execute(TSQL) # TSQL now ends with a SELECT statement
-
-                # Attempt to fetch the results of the SELECT statement
-                results_fetched = False
-                try:
-                    row = cur.fetchone()
-                    if row:
-                        logging.info(f"T-SQL execution summary: TotalInsertedInRun = {row.TotalInsertedInRun}, TotalUpdatedInRun = {row.TotalUpdatedInRun}")
-                        results_fetched = True
-                    else:
-                        logging.warning("T-SQL execution did not return a result row for counts.")
-                except pyodbc.ProgrammingError as pe:
-                    # This can happen if no results are returned (e.g. if TSQL had an error before SELECT)
-                    logging.warning(f"Could not fetch T-SQL summary results: {pe}. This might be normal if TSQL had no SELECT output.")
-
-
-                # Process any informational PRINT messages (though we don't expect many critical ones now)
-                # It's important to process messages even if results are fetched,
-                # or sometimes pyodbc can get into a strange state with multiple result sets / messages.
-                # However, if fetchone() worked, nextset() might be needed if there were PRINTs *before* SELECT.
-                # For simplicity here, we'll try to clear messages after attempting to fetch.
-                # If there were PRINTs *before* the final SELECT, they might need `cur.nextset()` to clear before `fetchone()` for the SELECT.
-                # Let's assume PRINTs are minimal and don't interfere with the final SELECT's resultset.
-                
-                # Simplified message processing:
-                # After execute, if there are messages, process them.
-                # The SELECT result is handled by fetchone().
-                # If there were PRINTs *after* the SELECT, nextset() would be needed.
-                # This ordering might need adjustment if PRINTs and SELECT results mix in complex ways.
-
-                logging.info("Attempting to process any remaining SQL PRINT messages...")
-                processed_messages = False
-                while True:
+        with connect() as cn:
+            logging.info("Connected - preparing index and Id ranges...")
+            bounds = cn.cursor().execute(TSQL_PREPARE).fetchone()
+
+        if not bounds or bounds.LoId is None:
+            logging.info("dbo.MasterItems is empty - nothing to back-fill.")
+        else:
+            ranges = split_id_range(bounds.LoId, bounds.HiId, PARALLEL_WORKERS)
+            logging.info(f"Running diagnostic back-fill (v5) over {len(ranges)} Id range(s) in parallel...")
+
+            total_inserted = total_updated = 0
+            failed_ranges = []
+            with ThreadPoolExecutor(max_workers=len(ranges)) as pool:
+                futures = {pool.submit(run_backfill_range, lo, hi): (lo, hi) for lo, hi in ranges}
+                for fut in as_completed(futures):
+                    lo, hi = futures[fut]
                     try:
-                        # Process messages from the current result set (if any from before SELECT)
-                        while cur.messages:
-                            sql_message = cur.messages.pop(0)[1]
-                            logging.info(f"SQL PRINT (current_result_set): {sql_message}")
-                            processed_messages = True
-                        
-                        # Move to the next result set (if any). This also clears PRINT messages
-                        # that might be between result sets or after the last one.
-                        if not cur.nextset():
-                            break # No more result sets
-                    except pyodbc.ProgrammingError:
-                        # This can happen if there are no more results/messages to process.
-                        logging.info("No more result sets or messages to process from pyodbc.")
-                        break
-                
-                if not results_fetched and not processed_messages:
-                    logging.info("No summary results fetched and no SQL PRINT messages processed after T-SQL execution.")
-
-
-            except pyodbc.Error as stmt_ex:
-                sqlstate = stmt_ex.args[0]
-                error_message = stmt_ex.args[1]
-                logging.error(f"SQL Error during T-SQL block execution ({sqlstate}): {error_message}")
-                logging.error(f"Start of T-SQL block (approx first 200 chars): {TSQL[:200]}")
-                raise 
-        
-        logging.info("T-SQL block execution attempted. Review logs for summary and any T-SQL PRINT output.")
+                        inserted, updated = fut.result()
+                        total_inserted += inserted
+                        total_updated += updated
+                    except (pyodbc.Error, RuntimeError) as stmt_ex:
+                        logging.error(f"SQL Error in range {lo}-{hi}: {stmt_ex}")
+                        failed_ranges.append((lo, hi))
+
+            logging.info(f"T-SQL execution summary: TotalInsertedInRun = {total_inserted}, TotalUpdatedInRun = {total_updated}")
+            if failed_ranges:
+                logging.error(f"{len(failed_ranges)} range(s) failed and can be re-run: {failed_ranges}")
+                sys.exit(1)
+
+        logging.info("T-SQL block execution attempted. Review logs for summary.")
 
     except pyodbc.Error as db_ex:
         sqlstate = db_ex.args[0]
@@ -220,4 +162,4 @@ if __name__ == "__main__":
         logging.exception(f"An unexpected Python error occurred: {e}")
         sys.exit(1)
     finally:
-        logging.info("Diagnostic script finished (v5).")
\ No newline at end of file
+        logging.info("Diagnostic script finished (v5).")
@@ -34,28 +34,45 @@ CONN_STR = (
 )
 
 QUERY = """
-SELECT mi.Id,
+SELECT TOP (?)
+       mi.Id,
        mi.FullName,
-       mi.IDNumber
+       mi.IDNumber,
+       COUNT(*) OVER() AS Total   -- full remaining count, same scan as the sample
 FROM   dbo.MasterItems AS mi
 LEFT   JOIN dbo.BirthDates AS bd ON bd.Id = mi.Id
 WHERE  bd.Id IS NULL            -- no row
    OR  bd.BirthDate IS NULL     -- or row exists but NULL
+ORDER  BY mi.Id;
+"""
+
+# Count-only variant for SHOW_ROWS = 0 (e.g. health checks) - no sample, no sort.
+COUNT_QUERY = """
+SELECT COUNT(*)
+FROM   dbo.MasterItems AS mi
+LEFT   JOIN dbo.BirthDates AS bd ON bd.Id = mi.Id
+WHERE  bd.Id IS NULL
+   OR  bd.BirthDate IS NULL;
 """
 
 def main():
     with pyodbc.connect(CONN_STR) as cn:
         cur = cn.cursor()
 
-        # 1️⃣  Total remaining
-        cur.execute("SELECT COUNT(*) FROM (" + QUERY + ") x;")
-        remaining = cur.fetchone()[0]
+        # 1️⃣  Count only - skip the sample query entirely
+        if SHOW_ROWS <= 0:
+            remaining = cur.execute(COUNT_QUERY).fetchval()
+            print(f"Voters missing BirthDate : {remaining}")
+            return
+
+        # Total remaining + sample list (first SHOW_ROWS) in one round-trip
+        cur.execute(QUERY, SHOW_ROWS)
+        rows = cur.fetchall()
+        remaining = rows[0].Total if rows else 0
         print(f"Voters missing BirthDate : {remaining}")
 
-        # 2️⃣  Sample list (first SHOW_ROWS)
-        if remaining:
-            cur.execute(QUERY + " ORDER BY mi.Id OFFSET 0 ROWS FETCH NEXT ? ROWS ONLY;", SHOW_ROWS)
-            rows = cur.fetchall()
+        # 2️⃣  Sample list
+        if rows:
             print(f"\nFirst {len(rows)} rows needing attention:")
             print("-" * 60)
             for r in rows:
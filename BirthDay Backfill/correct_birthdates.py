@@ -11,12 +11,12 @@ It exports a CSV of all records that were changed.
 
 import os
 import sys
-import textwrap
 import pyodbc
 from dotenv import load_dotenv
 import logging
 from datetime import datetime
 import csv
+from script_support import setup_logging, stream_csv_batches, count_remaining_rows
 
 # ── 0.  CONFIGURATION & LOGGING SETUP ────────────────────────────────────
 # --- User Configuration ---
@@ -28,6 +28,11 @@ CORRECTION_THRESHOLD_DATE = '2008-02-23'
 # A CSV of records that WOULD be changed will still be generated.
 # Set to False to perform the actual database update.
 DRY_RUN = False
+
+# Rows pulled per fetchmany() and the CSV write buffer used while streaming the export.
+FETCH_BATCH_SIZE = 10_000
+CSV_BUFFER_BYTES = 1 << 20
+EXPORT_QUEUE_BATCHES = 4   # fetched batches buffered between the DB fetch and the CSV writer thread
 # --- End User Configuration ---
 
 # Log file setup
@@ -43,14 +48,7 @@ try:
 except Exception:
     pass
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(log_file_full_path, encoding='utf-8'),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+setup_logging(log_file_full_path)
 
 # ── 1.  CONNECTION DETAILS ──────────────────────────────────────────────
 DB_DRIVER   = os.getenv('DB_DRIVER', '{ODBC Driver 17 for SQL Server}')
@@ -75,62 +73,14 @@ CONN_STR = (
 )
 
 # ── 2.  THE T-SQL FOR CORRECTING RECORDS ─────────────────────────────────
-# This T-SQL updates the BirthDate by subtracting 100 years and uses the
-# OUTPUT clause to return the old and new values of the changed rows.
-TSQL_CORRECT_RECORDS = textwrap.dedent(f"""
-    SET NOCOUNT ON;
-    
-    -- Declare variables for the execution
-    DECLARE @ThresholdDate DATE = '{CORRECTION_THRESHOLD_DATE}';
-    DECLARE @DryRun BIT = {1 if DRY_RUN else 0};
-    DECLARE @UpdatedCount INT;
-
-    -- Create a table variable to capture the changes
-    DECLARE @ChangedRecords TABLE (
-        Id INT,
-        MasterItemId NVARCHAR(255),
-        OldBirthDate DATE,
-        NewBirthDate DATE
-    );
-
-    PRINT N'Starting BirthDate correction process.';
-    PRINT CONCAT(N'Criteria: BirthDate > ''', CONVERT(NVARCHAR(10), @ThresholdDate, 23), N'''');
-
-    -- Begin a transaction to ensure atomicity
-    BEGIN TRANSACTION;
-
-    -- Perform the update and capture the changes into the table variable
-    UPDATE dbo.BirthDates
-    SET 
-        BirthDate = DATEADD(year, -100, BirthDate)
-    OUTPUT 
-        deleted.Id,
-        deleted.MasterItemId,
-        deleted.BirthDate, -- The old value
-        inserted.BirthDate -- The new value
-    INTO @ChangedRecords
-    WHERE BirthDate > @ThresholdDate;
-
-    SET @UpdatedCount = @@ROWCOUNT;
-    PRINT CONCAT(N'Found and updated ', @UpdatedCount, N' records in the transaction.');
-
-    -- Commit or Rollback the transaction based on the DryRun flag
-    IF @DryRun = 1
-    BEGIN
-        PRINT N'DRY RUN MODE: Rolling back the transaction. No changes were saved.';
-        ROLLBACK TRANSACTION;
-    END
-    ELSE
-    BEGIN
-        PRINT N'LIVE RUN: Committing the transaction to the database.';
-        COMMIT TRANSACTION;
-    END
-
-    -- Select the captured changes to be returned to the Python script
-    PRINT N'Returning the list of changed records for CSV export.';
-    SELECT Id, MasterItemId, OldBirthDate, NewBirthDate FROM @ChangedRecords
-    ORDER BY OldBirthDate ASC, Id ASC;
-""")
+# dbo.usp_CorrectBirthDates (migrations/usp_CorrectBirthDates.sql) updates the BirthDate
+# by subtracting 100 years and returns the old and new values of the changed rows.
+# It commits or rolls back its own transaction depending on @DryRun.
+TSQL_CORRECT_RECORDS = "{CALL dbo.usp_CorrectBirthDates(?, ?)}"
+
+# Session options sent once per connection; NOCOUNT keeps the changed-rows SELECT the only result.
+SESSION_SETUP = "SET NOCOUNT ON; SET ARITHABORT ON; SET ANSI_WARNINGS ON;"
+
 
 # ── 3.  RUN THE UPDATE SCRIPT AND EXPORT RESULTS ─────────────────────────
 if __name__ == "__main__":
@@ -159,57 +109,45 @@ if __name__ == "__main__":
     print("-"*70)
 
     try:
-        # Connect with autocommit OFF to allow the transaction in SQL to be managed
+        # Autocommit ON: the procedure manages its own transaction (commit, or rollback on DRY_RUN)
         logging.info(f"Connecting to DB: SERVER={DB_SERVER}, DATABASE={DB_DATABASE}")
-        with pyodbc.connect(CONN_STR, autocommit=False) as cn:
+        with pyodbc.connect(CONN_STR, autocommit=True) as cn:
             cur = cn.cursor()
-            logging.info("Connected. Executing T-SQL to correct records...")
-            
-            cur.execute(TSQL_CORRECT_RECORDS)
-            
-            # <-- MODIFIED: Added loop to find the correct result set -->
-            rows = []
-            column_names = []
-            while True:
-                # Process any messages (like from PRINT statements)
-                while cur.messages:
-                    sql_message = cur.messages.pop(0)[1]
-                    logging.info(f"SQL PRINT: {sql_message}")
-
-                # Check if the current result is a query with columns
-                if cur.description:
-                    column_names = [column[0] for column in cur.description]
-                    rows = cur.fetchall()
-                    # After fetching, we might still have messages related to this result
-                    while cur.messages:
-                         sql_message = cur.messages.pop(0)[1]
-                         logging.info(f"SQL PRINT: {sql_message}")
-                
-                # Move to the next result set; break if there are no more
-                try:
-                    if not cur.nextset():
-                        break
-                except pyodbc.ProgrammingError:
-                    # This exception can be raised if there are no more sets.
-                    break
-            
-            if rows:
-                num_changed = len(rows)
-                log_msg = f"{num_changed} records were {'processed in DRY RUN' if DRY_RUN else 'permanently corrected'}."
-                logging.info(log_msg)
-                print(f"\n{log_msg}")
-
+            cur.arraysize = FETCH_BATCH_SIZE   # default size for every fetchmany() below
+            cur.execute(SESSION_SETUP)
+            logging.info(f"Connected. Executing dbo.usp_CorrectBirthDates (BirthDate > '{CORRECTION_THRESHOLD_DATE}')...")
+
+            cur.execute(TSQL_CORRECT_RECORDS, CORRECTION_THRESHOLD_DATE, DRY_RUN)
+
+            # The changed-records result set is streamed straight to CSV in batches.
+            num_changed = 0
+            csv_exported = False
+            column_names = [column[0] for column in cur.description]
+            first_batch = cur.fetchmany()
+            if first_batch:
                 # --- EXPORT TO CSV ---
                 try:
-                    logging.info(f"Exporting details of {num_changed} records to CSV: {csv_file_full_path}")
-                    with open(csv_file_full_path, 'w', newline='', encoding='utf-8') as csv_file:
+                    logging.info(f"Exporting details of changed records to CSV: {csv_file_full_path}")
+                    with open(csv_file_full_path, 'w', newline='', encoding='utf-8', buffering=CSV_BUFFER_BYTES) as csv_file:
                         writer = csv.writer(csv_file)
                         writer.writerow(column_names) # Header: Id, MasterItemId, OldBirthDate, NewBirthDate
-                        writer.writerows(rows)
+                        num_changed, write_error = stream_csv_batches(cur, first_batch, csv_file, writer, EXPORT_QUEUE_BATCHES)
+                    if write_error:
+                        raise write_error
                     logging.info("Export successful.")
-                    print(f">>> Details of all changed records exported to: {csv_file_full_path} <<<\n")
+                    csv_exported = True
                 except IOError as e:
                     logging.error(f"Failed to write to CSV file: {e}")
+                    if not num_changed:
+                        # The CSV could not be opened; the procedure has already run, so count its rows anyway
+                        num_changed = len(first_batch) + count_remaining_rows(cur)
+
+            if num_changed:
+                log_msg = f"{num_changed} records were {'processed in DRY RUN' if DRY_RUN else 'permanently corrected'}."
+                logging.info(log_msg)
+                print(f"\n{log_msg}")
+                if csv_exported:
+                    print(f">>> Details of all changed records exported to: {csv_file_full_path} <<<\n")
             else:
                 logging.info("Query executed, but no records were found matching the criteria.")
                 print("\nNo records found matching the criteria. No changes were made.")
@@ -0,0 +1,105 @@
+-- dbo.usp_BackfillBirthDates
+-- Populate dbo.BirthDates from MasterItems.IDNumber for every Id in [@LoId, @HiId]
+-- that is still missing a BirthDate. Called once per Id range by backfill_birthdates.py.
+-- Relies on MasterItems.IsNumericId6, which backfill_birthdates.py creates on first run.
+-- Deploy: sqlcmd -S . -d sa_database_enrichment -i usp_BackfillBirthDates.sql
+-- A procedure keeps the SET options it was created with. QUOTED_IDENTIFIER / ANSI_NULLS must be ON
+-- for DML against dbo.BirthDates, which has the filtered index IX_BirthDates_NullBirthDate
+-- (backfill_birthdates.py), or it fails with Msg 1934; sqlcmd defaults QUOTED_IDENTIFIER to OFF,
+-- hence the explicit SETs.
+SET ANSI_NULLS ON;
+SET QUOTED_IDENTIFIER ON;
+GO
+CREATE OR ALTER PROCEDURE dbo.usp_BackfillBirthDates
+    @BatchSize  int,
+    @LoId       int,
+    @HiId       int,
+    @MaxSeconds int,
+    @MaxBatches int
+AS
+BEGIN
+    SET NOCOUNT ON;
+    SET XACT_ABORT ON;  -- a failed batch rolls back its own transaction only
+
+    DECLARE @StartTime datetime2 = SYSUTCDATETIME(), @BatchesDone int = 0, @StoppedEarly bit = 0;
+    DECLARE @pivotYY char(2) = RIGHT(CONVERT(char(4), YEAR(GETDATE())), 2);  -- evaluated once per run
+
+    ---------------------------------------------------------------
+    -- One pass: materialise (Id, DOB) for every row in this range that
+    -- still needs a BirthDate, so MasterItems is scanned exactly once
+    ---------------------------------------------------------------
+    SELECT mi.Id, v.DOB
+    INTO   #Candidates
+    FROM   dbo.MasterItems mi
+    CROSS  APPLY (VALUES (TRY_CONVERT(date,
+                CASE WHEN LEFT(mi.IDNumber,2) > @pivotYY
+                     THEN '19'+LEFT(mi.IDNumber,6)
+                     ELSE '20'+LEFT(mi.IDNumber,6) END))) AS v(DOB)
+    LEFT   JOIN dbo.BirthDates bd ON bd.Id = mi.Id
+    WHERE  mi.Id BETWEEN @LoId AND @HiId
+      AND  (bd.Id IS NULL OR bd.BirthDate IS NULL)
+      AND  mi.IsNumericId6 = 1
+      AND  v.DOB IS NOT NULL;
+    CREATE UNIQUE CLUSTERED INDEX IX_Candidates_Id ON #Candidates (Id);
+
+    ---------------------------------------------------------------
+    -- MERGE loop over #Candidates in Id order: INSERT rows that don't
+    -- exist and UPDATE rows whose BirthDate is still NULL
+    ---------------------------------------------------------------
+    DECLARE @lastId_v5 int = @LoId - 1, @batchHi_v5 int;
+    DECLARE @totalInserted_v5 int = 0, @totalUpdated_v5 int = 0;
+    DECLARE @mergeActions_v5 TABLE (MergeAction nvarchar(10));
+    -- IDENTITY_INSERT is toggled once for the whole loop; CATCH guarantees it is switched back OFF
+    SET IDENTITY_INSERT dbo.BirthDates ON;
+    BEGIN TRY
+        WHILE 1 = 1
+        BEGIN
+            -- Upper Id of the next batch: a seek on #Candidates' clustered index
+            SELECT @batchHi_v5 = MAX(Id)
+            FROM   (SELECT TOP (@BatchSize) Id FROM #Candidates
+                    WHERE Id > @lastId_v5 ORDER BY Id) AS nxt;
+            IF @batchHi_v5 IS NULL BEGIN BREAK; END
+
+            BEGIN TRAN;
+            MERGE dbo.BirthDates AS tgt
+            USING (
+                SELECT c.Id, c.DOB
+                FROM   #Candidates c
+                WHERE  c.Id > @lastId_v5 AND c.Id <= @batchHi_v5
+            ) AS src ON tgt.Id = src.Id
+            WHEN MATCHED AND tgt.BirthDate IS NULL THEN
+                UPDATE SET BirthDate = src.DOB
+            WHEN NOT MATCHED THEN
+                INSERT (Id, MasterItemId, BirthDate) VALUES (src.Id, src.Id, src.DOB)
+            OUTPUT $action INTO @mergeActions_v5;
+            COMMIT TRAN;  -- one transaction per batch keeps the log truncatable and releases locks
+
+            SELECT @totalInserted_v5 = @totalInserted_v5 + SUM(CASE WHEN MergeAction = 'INSERT' THEN 1 ELSE 0 END),
+                   @totalUpdated_v5  = @totalUpdated_v5  + SUM(CASE WHEN MergeAction = 'UPDATE' THEN 1 ELSE 0 END)
+            FROM   @mergeActions_v5
+            HAVING COUNT(*) > 0;
+            DELETE FROM @mergeActions_v5;
+
+            SET @lastId_v5 = @batchHi_v5;
+            SET @BatchesDone += 1;
+            IF @BatchesDone >= @MaxBatches
+               OR DATEDIFF(second, @StartTime, SYSUTCDATETIME()) > @MaxSeconds
+            BEGIN
+                SET @StoppedEarly = 1;
+                BREAK;
+            END
+            WAITFOR DELAY '00:00:00.050';  -- breathing room for checkpoints / log backups
+        END
+    END TRY
+    BEGIN CATCH
+        IF @@TRANCOUNT > 0 ROLLBACK TRAN;
+        SET IDENTITY_INSERT dbo.BirthDates OFF;
+        THROW;
+    END CATCH
+    SET IDENTITY_INSERT dbo.BirthDates OFF;
+
+    DROP TABLE #Candidates;
+
+    SELECT @totalInserted_v5 AS TotalInsertedInRun, @totalUpdated_v5 AS TotalUpdatedInRun,
+           @BatchesDone AS BatchesDone, @lastId_v5 AS LastProcessedId, @StoppedEarly AS StoppedEarly;
+END
@@ -0,0 +1,53 @@
+-- dbo.usp_CorrectBirthDates
+-- Subtract 100 years from every BirthDate > @ThresholdDate and return the changed rows
+-- (old and new values). With @DryRun = 1 the update is rolled back but the rows are
+-- still returned. Called by correct_birthdates.py.
+-- Deploy: sqlcmd -S . -d sa_database_enrichment -i usp_CorrectBirthDates.sql
+-- A procedure keeps the SET options it was created with. QUOTED_IDENTIFIER / ANSI_NULLS must be ON
+-- for DML against dbo.BirthDates, which has the filtered index IX_BirthDates_NullBirthDate
+-- (backfill_birthdates.py), or it fails with Msg 1934; sqlcmd defaults QUOTED_IDENTIFIER to OFF,
+-- hence the explicit SETs.
+SET ANSI_NULLS ON;
+SET QUOTED_IDENTIFIER ON;
+GO
+CREATE OR ALTER PROCEDURE dbo.usp_CorrectBirthDates
+    @ThresholdDate DATE,
+    @DryRun        BIT
+AS
+BEGIN
+    SET NOCOUNT ON;
+    SET XACT_ABORT ON;
+
+    -- Create a table variable to capture the changes
+    DECLARE @ChangedRecords TABLE (
+        Id INT,
+        MasterItemId NVARCHAR(255),
+        OldBirthDate DATE,
+        NewBirthDate DATE
+    );
+
+    -- Begin a transaction to ensure atomicity
+    BEGIN TRANSACTION;
+
+    -- Perform the update and capture the changes into the table variable
+    UPDATE dbo.BirthDates
+    SET 
+        BirthDate = DATEADD(year, -100, BirthDate)
+    OUTPUT 
+        deleted.Id,
+        deleted.MasterItemId,
+        deleted.BirthDate, -- The old value
+        inserted.BirthDate -- The new value
+    INTO @ChangedRecords
+    WHERE BirthDate > @ThresholdDate;
+
+    -- Commit or Rollback the transaction based on the DryRun flag
+    IF @DryRun = 1
+        ROLLBACK TRANSACTION;
+    ELSE
+        COMMIT TRANSACTION;
+
+    -- Select the captured changes to be returned to the Python script
+    SELECT Id, MasterItemId, OldBirthDate, NewBirthDate FROM @ChangedRecords
+    ORDER BY OldBirthDate ASC, Id ASC;
+END
@@ -0,0 +1,28 @@
+-- dbo.usp_ExportBirthDates
+-- Read-only: return dbo.BirthDates rows with BirthDate > @ThresholdDate.
+-- Called by query_birthdate_corrections.py (both the bcp and the pyodbc export paths).
+-- Deploy: sqlcmd -S . -d sa_database_enrichment -i usp_ExportBirthDates.sql
+-- A procedure keeps the SET options it was created with. This one only reads dbo.BirthDates, but it
+-- is created with QUOTED_IDENTIFIER / ANSI_NULLS ON like the procedures that write it (their DML fails
+-- with Msg 1934 otherwise, because of the filtered index IX_BirthDates_NullBirthDate); sqlcmd
+-- defaults QUOTED_IDENTIFIER to OFF, hence the explicit SETs.
+SET ANSI_NULLS ON;
+SET QUOTED_IDENTIFIER ON;
+GO
+CREATE OR ALTER PROCEDURE dbo.usp_ExportBirthDates
+    @ThresholdDate DATE
+AS
+BEGIN
+    SET NOCOUNT ON;
+
+    SELECT
+        bd.[Id],
+        bd.[MasterItemId],
+        bd.[BirthDate],
+        bd.[Age]
+        -- Add any other columns from dbo.BirthDates you wish to see here. The bcp export
+        -- writes fields unquoted, so a text column must not contain commas or line breaks.
+    FROM dbo.BirthDates bd
+    WHERE bd.BirthDate > @ThresholdDate
+    ORDER BY bd.BirthDate ASC, bd.[Id] ASC;
+END
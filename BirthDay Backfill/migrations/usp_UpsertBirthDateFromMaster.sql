@@ -0,0 +1,50 @@
+-- dbo.usp_UpsertBirthDateFromMaster
+-- Derive the BirthDate for one MasterItems.Id from its IDNumber and MERGE it into
+-- dbo.BirthDates. Returns the six-digit block and the derived date (either may be NULL).
+-- Called by get_birthdate_by_masterid.py.
+-- Deploy: sqlcmd -S . -d sa_database_enrichment -i usp_UpsertBirthDateFromMaster.sql
+-- A procedure keeps the SET options it was created with. QUOTED_IDENTIFIER / ANSI_NULLS must be ON
+-- for DML against dbo.BirthDates, which has the filtered index IX_BirthDates_NullBirthDate
+-- (backfill_birthdates.py), or it fails with Msg 1934; sqlcmd defaults QUOTED_IDENTIFIER to OFF,
+-- hence the explicit SETs.
+SET ANSI_NULLS ON;
+SET QUOTED_IDENTIFIER ON;
+GO
+CREATE OR ALTER PROCEDURE dbo.usp_UpsertBirthDateFromMaster
+    @Id INT
+AS
+BEGIN
+    SET NOCOUNT ON;
+    DECLARE @pivotYY char(2) = RIGHT(CONVERT(char(4), YEAR(GETDATE())), 2),
+            @id6     char(6),
+            @dob     date;
+
+    SELECT @id6 = LEFT(IDNumber, 6)
+    FROM   dbo.MasterItems
+    WHERE  Id = @Id
+      AND  IDNumber LIKE '[0-9][0-9][0-9][0-9][0-9][0-9]%';
+
+    SET @dob = TRY_CONVERT(date, CASE WHEN LEFT(@id6, 2) > @pivotYY
+                                      THEN '19' + @id6
+                                      ELSE '20' + @id6 END);
+
+    IF @dob IS NOT NULL
+    BEGIN
+        SET IDENTITY_INSERT dbo.BirthDates ON;
+        BEGIN TRY
+            MERGE dbo.BirthDates AS t
+            USING (VALUES (@Id, @dob)) AS s (Id, Dob) ON t.Id = s.Id
+            WHEN MATCHED THEN
+                UPDATE SET BirthDate = s.Dob
+            WHEN NOT MATCHED THEN
+                INSERT (Id, MasterItemId, BirthDate) VALUES (s.Id, s.Id, s.Dob);
+        END TRY
+        BEGIN CATCH
+            SET IDENTITY_INSERT dbo.BirthDates OFF;
+            THROW;
+        END CATCH
+        SET IDENTITY_INSERT dbo.BirthDates OFF;
+    END
+
+    SELECT @id6 AS DobBlock, @dob AS BirthDate;
+END
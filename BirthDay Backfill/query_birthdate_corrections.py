@@ -9,18 +9,30 @@ This script is READ-ONLY and does not make any changes to the database.
 """
 
 import os
+import re
+import shutil
+import subprocess
 import sys
-import textwrap
 import pyodbc
 from dotenv import load_dotenv
 import logging
-from datetime import datetime
+from datetime import date, datetime
 import csv  # <-- ADDED: Import the csv module for file export
+from script_support import setup_logging, stream_csv_batches, count_remaining_rows
 
 # ── 0.  CONFIGURATION & LOGGING SETUP ────────────────────────────────────
 # --- User Configuration ---
 # This is the threshold date. BirthDates AFTER this date will be queried.
 CORRECTION_THRESHOLD_DATE = '2008-02-23' # From your SQL query
+FETCH_BATCH_SIZE = 10_000      # rows pulled per fetchmany() while streaming to CSV
+CSV_BUFFER_BYTES = 1 << 20     # 1 MiB write buffer for the CSV file
+EXPORT_QUEUE_BATCHES = 4       # fetched batches buffered between the DB fetch and the CSV writer thread
+# Export with the server-side `bcp queryout` utility when it is on PATH; rows go
+# straight from SQL Server to disk. bcp signs in with Windows authentication (-T), so
+# no password is put on its command line. Falls back to the pyodbc stream otherwise.
+USE_BCP_EXPORT = True
+# Console preview of the first rows; skipped with --no-preview or SALTROUTE_QUIET=1 (e.g. in pipelines).
+SHOW_PREVIEW = not ('--no-preview' in sys.argv[1:] or os.getenv('SALTROUTE_QUIET') == '1')
 # --- End User Configuration ---
 
 # Log file setup
@@ -37,14 +49,7 @@ try:
 except Exception:
     pass
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(log_file_full_path, encoding='utf-8'),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+setup_logging(log_file_full_path)
 
 # ── 1.  CONNECTION DETAILS ──────────────────────────────────────────────
 DB_DRIVER   = os.getenv('DB_DRIVER', '{ODBC Driver 17 for SQL Server}')
@@ -69,103 +74,138 @@ CONN_STR = (
 )
 
 # ── 2.  THE T-SQL FOR QUERYING RECORDS ───────────────────────────────────
-# This T-SQL selects specified columns from dbo.BirthDates based on the threshold.
-TSQL_EXPORT_RECORDS = textwrap.dedent(f"""
-    USE [{DB_DATABASE}];
-    SET NOCOUNT ON;
-
-    DECLARE @ThresholdDate DATE = '{CORRECTION_THRESHOLD_DATE}';
-
-    PRINT N'Selecting records from dbo.BirthDates for viewing and export.';
-    PRINT CONCAT(N'Criteria: BirthDate > ''', CONVERT(NVARCHAR(10), @ThresholdDate, 23), N'''');
-
-    SELECT
-        bd.[Id],
-        bd.[MasterItemId],
-        bd.[BirthDate],
-        bd.[Age]
-        -- Add any other columns from dbo.BirthDates you wish to see here
-    FROM dbo.BirthDates bd
-    WHERE bd.BirthDate > @ThresholdDate
-    ORDER BY bd.BirthDate ASC, bd.[Id] ASC;
-""")
+# dbo.usp_ExportBirthDates (migrations/usp_ExportBirthDates.sql) selects the export
+# columns from dbo.BirthDates for BirthDate > @ThresholdDate.
+TSQL_EXPORT_RECORDS = "{CALL dbo.usp_ExportBirthDates(?)}"
+
+# Session options sent once per connection; NOCOUNT keeps the SELECT the only result.
+SESSION_SETUP = "SET NOCOUNT ON; SET ARITHABORT ON; SET ANSI_WARNINGS ON;"
+
+# bcp cannot bind parameters, so the (validated) threshold is inlined into the EXEC.
+BCP_EXPORT_QUERY = "EXEC dbo.usp_ExportBirthDates @ThresholdDate = '{threshold}'"
+BCP_COLUMN_NAMES = ['Id', 'MasterItemId', 'BirthDate', 'Age']
+
+
+def export_with_bcp():
+    """
+    Export the matching rows with `bcp queryout` straight into csv_file_full_path.
+    The file is raw comma-delimited text: bcp -c does not quote fields, which is only
+    safe because every exported column is a number or a date.
+    Returns the number of rows exported, or None if bcp is unavailable or failed
+    (the caller then falls back to the pyodbc stream).
+    """
+    bcp_path = shutil.which('bcp')
+    if not bcp_path:
+        logging.info("bcp not found on PATH; using the pyodbc export.")
+        return None
+
+    threshold = date.fromisoformat(CORRECTION_THRESHOLD_DATE).isoformat()  # raises on anything but a date
+    body_path = csv_file_full_path + '.body'
+    cmd = [
+        bcp_path, BCP_EXPORT_QUERY.format(threshold=threshold), 'queryout', body_path,
+        '-c', '-t,', '-S', DB_SERVER, '-d', DB_DATABASE, '-T',
+    ]
+    logging.info(f"Exporting records with bcp (raw comma-delimited text, fields unquoted) to: {csv_file_full_path}")
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True)
+        match = re.search(r'(\d+) rows copied', result.stdout)
+        if result.returncode != 0 or not match:
+            logging.warning(f"bcp export failed (exit code {result.returncode}, e.g. no Windows login for this user); using the pyodbc export.")
+            return None
+
+        rows = int(match.group(1))
+        if rows:
+            # bcp writes no header; prepend it with a file-to-file copy of the body
+            with open(csv_file_full_path, 'w', newline='', encoding='utf-8', buffering=CSV_BUFFER_BYTES) as csv_file, \
+                 open(body_path, newline='', encoding='utf-8') as body_file:
+                csv.writer(csv_file).writerow(BCP_COLUMN_NAMES)
+                shutil.copyfileobj(body_file, csv_file, CSV_BUFFER_BYTES)
+        return rows
+    finally:
+        if os.path.exists(body_path):
+            os.remove(body_path)
+
+
+def print_preview(column_names, sample_rows, total_rows):
+    """Print the first rows of the export as a console preview of the CSV (one write)."""
+    lines = [f"--- Displaying a sample of records (first {min(total_rows, 20)} of {total_rows} total rows) ---"]
+    if column_names:
+        header = "\t|\t".join(column_names)
+        lines.append(header)
+        lines.append("─" * (len(header) + 4))
+    for row in sample_rows[:20]:
+        lines.append("\t|\t".join(["NULL" if col is None else str(col) for col in row]))
+    if total_rows > 20:
+        lines.append(f"... and {total_rows - 20} more rows not displayed here (see full CSV export).")
+    lines.append("--- End of sample ---")
+    print("\n".join(lines))
+
 
 # ── 3.  RUN THE QUERY, EXPORT, AND DISPLAY RESULTS ─────────────────────────
 if __name__ == "__main__":
     logging.info(f"Starting script to export records from dbo.BirthDates (BirthDate > '{CORRECTION_THRESHOLD_DATE}').")
     
     try:
-        logging.info(f"Connecting to DB: SERVER={DB_SERVER}, DATABASE={DB_DATABASE}, USER={DB_USER}")
-        with pyodbc.connect(CONN_STR, autocommit=True) as cn:
-            logging.info("Connected. Executing T-SQL to fetch records...")
-            cur = cn.cursor()
-            
-            cur.execute(TSQL_EXPORT_RECORDS)
-
-            # Process any PRINT messages that come before the main result set
-            while cur.messages:
-                sql_message = cur.messages.pop(0)[1]
-                logging.info(f"SQL PRINT: {sql_message}")
-            
-            # Find and process the main query result set
-            rows = []
-            column_names = []
-            found_query_result_set = False
-            
-            while True:
-                if cur.description:  # This indicates a result set with columns
+        bcp_rows = export_with_bcp() if USE_BCP_EXPORT else None
+        if bcp_rows:
+            logging.info(f"Successfully exported {bcp_rows} records matching the criteria to {csv_file_full_path}")
+            print(f"\n>>> Full results have been exported to: {csv_file_full_path} <<<\n")
+            if SHOW_PREVIEW:
+                with open(csv_file_full_path, newline='', encoding='utf-8') as csv_file:
+                    reader = csv.reader(csv_file)
+                    column_names = next(reader)
+                    print_preview(column_names, [row for _, row in zip(range(20), reader)], bcp_rows)
+        elif bcp_rows == 0:
+            logging.info("Query executed successfully, but no records were found matching the criteria.")
+            print("\nNo records found matching the criteria. No CSV file was created.")
+        else:
+            logging.info(f"Connecting to DB: SERVER={DB_SERVER}, DATABASE={DB_DATABASE}, USER={DB_USER}")
+            with pyodbc.connect(CONN_STR, autocommit=True) as cn:
+                logging.info("Connected. Executing dbo.usp_ExportBirthDates...")
+                cur = cn.cursor()
+                cur.arraysize = FETCH_BATCH_SIZE   # default size for every fetchmany() below
+                cur.execute(SESSION_SETUP)
+
+                cur.execute(TSQL_EXPORT_RECORDS, CORRECTION_THRESHOLD_DATE)
+
+                # The SELECT is the only result set, so there is nothing to drain before it
+                if cur.description:
                     column_names = [column[0] for column in cur.description]
                     logging.info(f"Fetching rows for columns: {', '.join(column_names)}")
-                    rows = cur.fetchall()
-                    found_query_result_set = True
-                    break  # Found our data, exit the loop
-                
-                try:
-                    if not cur.nextset():
-                        break
-                except pyodbc.ProgrammingError:
-                    break
-
-            if found_query_result_set:
-                if rows:
-                    logging.info(f"Successfully fetched {len(rows)} records matching the criteria.")
-                    
-                    # <-- ADDED: CSV EXPORT LOGIC -->
-                    try:
-                        logging.info(f"Attempting to export {len(rows)} records to CSV: {csv_file_full_path}")
-                        with open(csv_file_full_path, 'w', newline='', encoding='utf-8') as csv_file:
-                            writer = csv.writer(csv_file)
-                            # Write the header row
-                            writer.writerow(column_names)
-                            # Write all the data rows
-                            writer.writerows(rows)
-                        logging.info(f"Successfully exported data to {csv_file_full_path}")
-                        print(f"\n>>> Full results have been exported to: {csv_file_full_path} <<<\n")
-                    except IOError as e:
-                        logging.error(f"Failed to write to CSV file: {e}")
-                        print(f"\n[ERROR] Could not write results to CSV file. Check permissions. See log for details.")
-                    # <-- END OF ADDED LOGIC -->
-
-                    # The console display now serves as a preview of the exported file
-                    print(f"--- Displaying a sample of records (first {min(len(rows), 20)} of {len(rows)} total rows) ---")
-                    if column_names:
-                        print("\t|\t".join(column_names))
-                        print("─" * (sum(len(name) for name in column_names) + (len(column_names) -1) * 3 + 4))
-                    for i, row in enumerate(rows):
-                        if i < 20:
-                            print("\t|\t".join(str(col) if col is not None else "NULL" for col in row))
-                        else:
-                            break
-                    if len(rows) > 20:
-                        print(f"... and {len(rows) - 20} more rows not displayed here (see full CSV export).")
-                    print("--- End of sample ---")
 
+                    # Peek the first batch; it decides whether a CSV is written and doubles as the preview
+                    first_batch = cur.fetchmany()
+                    if first_batch:
+                        total_rows = 0
+
+                        # Stream the full result set to CSV, one batch at a time
+                        try:
+                            logging.info(f"Streaming records to CSV: {csv_file_full_path}")
+                            with open(csv_file_full_path, 'w', newline='', encoding='utf-8', buffering=CSV_BUFFER_BYTES) as csv_file:
+                                writer = csv.writer(csv_file)
+                                # Write the header row
+                                writer.writerow(column_names)
+                                total_rows, write_error = stream_csv_batches(cur, first_batch, csv_file, writer, EXPORT_QUEUE_BATCHES)
+                            if write_error:
+                                raise write_error
+                            logging.info(f"Successfully exported {total_rows} records matching the criteria to {csv_file_full_path}")
+                            print(f"\n>>> Full results have been exported to: {csv_file_full_path} <<<\n")
+                        except IOError as e:
+                            logging.error(f"Failed to write to CSV file: {e}")
+                            print(f"\n[ERROR] Could not write results to CSV file. Check permissions. See log for details.")
+                            if not total_rows:
+                                # The CSV could not be opened; count the rows anyway for the preview total
+                                total_rows = len(first_batch) + count_remaining_rows(cur)
+
+                        if SHOW_PREVIEW:
+                            print_preview(column_names, first_batch, total_rows)
+
+                    else:
+                        logging.info("Query executed successfully, but no records were found matching the criteria.")
+                        print("\nNo records found matching the criteria. No CSV file was created.") # <-- MODIFIED: Clearer message
                 else:
-                    logging.info("Query executed successfully, but no records were found matching the criteria.")
-                    print("\nNo records found matching the criteria. No CSV file was created.") # <-- MODIFIED: Clearer message
-            else:
-                logging.error("Failed to retrieve a valid result set from the T-SQL query. Check logs for details.")
-                print("\n>>> Could not retrieve records. Please check log file. <<<\n")
+                    logging.error("Failed to retrieve a valid result set from the T-SQL query. Check logs for details.")
+                    print("\n>>> Could not retrieve records. Please check log file. <<<\n")
 
         logging.info("T-SQL execution and export phase completed.")
 
@@ -0,0 +1,97 @@
+"""
+script_support.py
+───────────────────
+Logging setup and CSV export helpers shared by the birth-date scripts in this folder.
+Run the scripts from this folder so `import script_support` resolves.
+"""
+
+import sys
+import logging
+from logging.handlers import MemoryHandler
+import queue
+import threading
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+
+def setup_logging(log_file_full_path):
+    """
+    Log INFO and above to stdout and to log_file_full_path.
+    File records are buffered and written in batches (immediately on ERROR); the
+    buffer is flushed by logging.shutdown() when the script exits.
+    """
+    file_handler = logging.FileHandler(log_file_full_path, encoding='utf-8')
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    buffered_file_handler = MemoryHandler(capacity=1024, flushLevel=logging.ERROR, target=file_handler)
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format=LOG_FORMAT,
+        handlers=[
+            buffered_file_handler,
+            logging.StreamHandler(sys.stdout)
+        ]
+    )
+
+
+def write_csv_rows(csv_file, writer, rows):
+    """
+    Write rows as plain comma-joined lines; a row with a value that needs quoting
+    (comma, quote or newline) goes through csv.writer instead. Output is identical
+    to writer.writerows(rows).
+    """
+    lines = []
+    for row in rows:
+        fields = ["" if col is None else str(col) for col in row]
+        line = ",".join(fields)
+        if line.count(",") != len(fields) - 1 or '"' in line or "\n" in line or "\r" in line:
+            csv_file.write("".join(lines))
+            lines.clear()
+            writer.writerow(row)
+        else:
+            lines.append(line + "\r\n")
+    csv_file.write("".join(lines))
+
+
+def stream_csv_batches(cur, first_batch, csv_file, writer, queue_batches):
+    """
+    Write first_batch and every remaining fetchmany() batch (cur.arraysize rows each) to the
+    CSV. Returns (row_count, write_error): write_error is the exception that stopped the
+    writer, or None. After a write error the rest of the result set is still fetched, so
+    row_count always covers every row.
+    A writer thread formats and writes while this thread fetches the next batch (pyodbc
+    releases the GIL during the fetch). The queue holds at most queue_batches batches.
+    """
+    batches = queue.Queue(maxsize=queue_batches)
+    errors = []
+
+    def drain():
+        try:
+            while (batch := batches.get()) is not None:
+                write_csv_rows(csv_file, writer, batch)
+        except BaseException as e:
+            errors.append(e)
+            while batches.get() is not None:   # discard the rest, keeping the fetching side unblocked
+                pass
+
+    writer_thread = threading.Thread(target=drain, daemon=True)
+    writer_thread.start()
+    total_rows = 0
+    try:
+        batch = first_batch
+        while batch:
+            batches.put(batch)
+            total_rows += len(batch)
+            batch = cur.fetchmany()
+    finally:
+        batches.put(None)
+        writer_thread.join()
+    return total_rows, errors[0] if errors else None
+
+
+def count_remaining_rows(cur):
+    """Fetch and discard the rest of cur's result set; returns how many rows it had."""
+    total_rows = 0
+    while rows := cur.fetchmany():
+        total_rows += len(rows)
+    return total_rows
@@ -3,13 +3,29 @@
 sa_id_mask_solver.py  –  generate every South-African ID that matches a 13-char mask.
   * Use ‘*’ for unknown digits in MASK.
   * Set GENDER = 'M', 'F', or 'U' (unknown).
+  * Run with --quiet to count matches without printing them.
+  * Run with --out PATH to write the IDs to a file (memory-mapped) instead of stdout.
 
 Example:
     MASK   = "970420****08*"
     GENDER = "F"
 """
 from itertools import product
+from functools import lru_cache
 from datetime import datetime
+import calendar
+import mmap
+import sys
+
+try:
+    import numpy as np                 # optional: vectorised Luhn over whole batches
+except ImportError:
+    np = None
+
+try:
+    from numba import njit, prange     # optional: compiled per-date enumeration kernel
+except ImportError:
+    njit = None
 
 # ────>  EDIT THESE TWO LINES  <────
 MASK   = "970420****08*"
@@ -19,44 +35,237 @@ GENDER = "M"              # 'M' / 'F' / 'U'
 assert len(MASK) == 13 and set(MASK) <= set("0123456789*"), "Mask must be 13 chars of 0-9 or *"
 
 def luhn_sa(stem12: str) -> str:
-    d = [int(x) for x in stem12]
-    odd  = sum(d[::2])
-    even = sum(int(y) for y in str(int(''.join(map(str, d[1::2])))*2))
-    return str((10 - (odd + even) % 10) % 10)
+    # Odd positions count as-is; even positions are doubled, minus 9 when that gives two
+    # digits. Same result as the digit sum of (even digits read as one number) × 2.
+    s = 0
+    for i, ch in enumerate(stem12):
+        x = ord(ch) - 48
+        s += x if i % 2 == 0 else (x * 2 if x < 5 else x * 2 - 9)
+    return str((10 - s % 10) % 10)
+
+def luhn_sa_batch(stems: list[str]) -> str:
+    """Check digits for many 12-digit stems at once; character i belongs to stems[i]."""
+    if np is None or not stems:
+        return "".join(luhn_sa(stem) for stem in stems)
+    digits = _digit_array(stems, 12).astype(np.int64)
+    odd = digits[:, 0::2].sum(axis=1)
+    doubled = digits[:, 1::2] * 2
+    even = (doubled - 9 * (doubled > 9)).sum(axis=1)  # same per-digit rule as luhn_sa
+    check = (10 - (odd + even) % 10) % 10
+    return (check + ord("0")).astype(np.uint8).tobytes().decode()
+
+# Calendar validity of every YYMMDD, built once: byte yy*10000 + mm*100 + dd is 1 when valid.
+# Years above the current two-digit year are 19xx, the rest 20xx.
+_PIVOT_YY = int(datetime.now().strftime("%y"))
+_VALID_DATE = bytearray(100 * 100 * 100)
+for _yy in range(100):
+    _year = _yy + (1900 if _yy > _PIVOT_YY else 2000)
+    for _mm in range(1, 13):
+        for _dd in range(1, calendar.monthrange(_year, _mm)[1] + 1):
+            _VALID_DATE[_yy * 10000 + _mm * 100 + _dd] = 1
 
 def valid_date(yy, mm, dd) -> bool:
-    try:
-        year = int(yy) + (1900 if int(yy) > int(datetime.now().strftime("%y")) else 2000)
-        datetime(year, int(mm), int(dd))
-        return True
-    except ValueError:
-        return False
-
-def gender_ok(id13: str) -> bool:
-    block = int(id13[6:10])            # digits 7-10 as a 4-digit number
-    if GENDER.upper() == "M":
-        return block >= 5000
-    if GENDER.upper() == "F":
-        return block < 5000
-    return True                        # 'U' → accept either
+    return bool(_VALID_DATE[int(yy) * 10000 + int(mm) * 100 + int(dd)])
+
+def _matches(digits: str, pattern: str) -> bool:
+    return all(p == "*" or p == d for d, p in zip(digits, pattern))
+
+def _slice_options(pattern: str) -> list[str]:
+    """All digit strings consistent with the fixed characters of a mask slice, in ascending order."""
+    return ["".join(c) for c in product(*(ch if ch != "*" else "0123456789" for ch in pattern))]
+
+# Every valid YYMMDD (≈36.5k entries), built once in ascending order.
+VALID_DATES = [f"{yy:02d}{mm:02d}{dd:02d}"
+               for yy in range(100) for mm in range(1, 13) for dd in range(1, 32)
+               if valid_date(yy, mm, dd)]
+
+def gender_blocks(pattern: str, gender: str) -> list[str]:
+    """Digits 7-10 allowed by the gender (F: 0000-4999, M: 5000-9999) and by the mask."""
+    g = gender.upper()
+    lo, hi = (5000, 10000) if g == "M" else (0, 5000) if g == "F" else (0, 10000)
+    return [b for b in (f"{n:04d}" for n in range(lo, hi)) if _matches(b, pattern)]
+
+def _digit_array(strings: list[str], width: int):
+    return np.frombuffer("".join(strings).encode(), dtype=np.uint8).reshape(-1, width) - ord("0")
+
+if njit is not None:
+    @njit(parallel=True, cache=True)
+    def _enumerate_dob(dob, blocks, tails, check, out):
+        """
+        Fill out[b * len(tails) + t] with dob + blocks[b] + tails[t] + Luhn digit for every
+        pair, in parallel over the blocks; returns the row mask of IDs whose check digit
+        agrees with `check` (-1 = wildcard).
+        """
+        nb, nt = blocks.shape[0], tails.shape[0]
+        keep = np.zeros(nb * nt, dtype=np.bool_)
+        for b in prange(nb):
+            for t in range(nt):
+                r = b * nt + t
+                out[r, 0:6] = dob
+                out[r, 6:10] = blocks[b]
+                out[r, 10:12] = tails[t]
+                s = 0
+                for i in range(12):
+                    x = int(out[r, i])
+                    if i % 2 == 0:
+                        s += x
+                    else:
+                        s += x * 2 if x < 5 else x * 2 - 9
+                digit = (10 - s % 10) % 10
+                out[r, 12] = digit
+                keep[r] = check < 0 or check == digit
+        return keep
+
+def _luhn_partial(digits: str, offset: int) -> int:
+    """Contribution of `digits`, starting at ID position `offset`, to the luhn_sa sum."""
+    s = 0
+    for i, ch in enumerate(digits, offset):
+        x = ord(ch) - 48
+        s += x if i % 2 == 0 else (x * 2 if x < 5 else x * 2 - 9)
+    return s
+
+_CHECK_CHAR = [str((10 - r) % 10) for r in range(10)]   # Luhn sum mod 10 → check digit
+
+# Up to this many block × tail candidates per date, the scalar specialize() path beats building
+# NumPy / Numba batches (and with a fixed check digit it skips ~90% of the candidates outright).
+SCALAR_MAX_PER_DATE = 1000
+
+@lru_cache(maxsize=None)
+def specialize(mask: str, gender: str):
+    """
+    Partially evaluate the search for one mask/gender and return ids_for(dob), a generator of
+    every matching ID with that date of birth. The Luhn contribution of each gender block and
+    tail is computed once; with a fixed check digit the tails are grouped by sum mod 10, so
+    only tails that produce that digit are visited.
+    """
+    blocks = [(block, _luhn_partial(block, 6)) for block in gender_blocks(mask[6:10], gender)]
+    tails  = [(tail, _luhn_partial(tail, 10)) for tail in _slice_options(mask[10:12])]
+    check  = mask[12]
+
+    if check == "*":
+        def ids_for(dob):
+            s_dob = _luhn_partial(dob, 0)
+            for block, s_block in blocks:
+                prefix, s = dob + block, s_dob + s_block
+                for tail, s_tail in tails:
+                    yield prefix + tail + _CHECK_CHAR[(s + s_tail) % 10]
+        return ids_for
+
+    need = (10 - int(check)) % 10                        # sum mod 10 that yields `check`
+    tails_by_residue = [[] for _ in range(10)]
+    for tail, s_tail in tails:
+        tails_by_residue[s_tail % 10].append(tail + check)
+
+    def ids_for(dob):
+        s_dob = _luhn_partial(dob, 0)
+        for block, s_block in blocks:
+            prefix = dob + block
+            for tail in tails_by_residue[(need - s_dob - s_block) % 10]:
+                yield prefix + tail
+    return ids_for
 
 def generate_ids(mask: str):
-    opts = []
-    for i, ch in enumerate(mask):
-        if ch != "*":
-            opts.append(ch)            # fixed digit
-        else:
-            opts.append("0123456789")  # wildcard
-    for combo in product(*opts):
-        cand = "".join(combo)
-        if not (valid_date(cand[:2], cand[2:4], cand[4:6]) and gender_ok(cand)):
-            continue
-        if luhn_sa(cand[:-1]) == cand[-1]:
-            yield cand
+    # Enumerate only the legal sub-spaces, slice by slice, and solve the check digit
+    # instead of trying all ten: date → gender block → citizenship/race → Luhn.
+    dates  = [d for d in VALID_DATES if _matches(d, mask[0:6])]
+    blocks = gender_blocks(mask[6:10], GENDER)
+    tails  = _slice_options(mask[10:12])
+    check  = mask[12]
+    if np is None or len(blocks) * len(tails) <= SCALAR_MAX_PER_DATE:
+        ids_for = specialize(mask, GENDER.upper())
+        for dob in dates:
+            yield from ids_for(dob)
+        return
+    if njit is not None:
+        block_arr, tail_arr = _digit_array(blocks, 4), _digit_array(tails, 2)
+        out = np.empty((len(blocks) * len(tails), 13), dtype=np.uint8)
+        check_digit = -1 if check == "*" else int(check)
+        for dob in dates:
+            keep = _enumerate_dob(_digit_array([dob], 6)[0], block_arr, tail_arr, check_digit, out)
+            text = (out[keep] + ord("0")).tobytes().decode()
+            for i in range(0, len(text), 13):
+                yield text[i:i + 13]
+        return
+    for dob in dates:
+        stems = [dob + block + tail for block in blocks for tail in tails]
+        for stem, digit in zip(stems, luhn_sa_batch(stems)):
+            if check == "*" or check == digit:
+                yield stem + digit
+
+OUTPUT_CHUNK_BYTES = 64 * 1024
+
+def count_upper_bound(mask: str) -> int:
+    """Candidates left after pruning; exact for a '*' check digit, an upper bound otherwise."""
+    dates = sum(1 for d in VALID_DATES if _matches(d, mask[0:6]))
+    return dates * len(gender_blocks(mask[6:10], GENDER)) * len(_slice_options(mask[10:12]))
+
+MMAP_MAX_INITIAL_BYTES = 64 * 1024 * 1024
+
+def write_ids_mmap(path: str, mask: str) -> int:
+    """
+    Write every matching ID plus newline (14 bytes each) into a memory-mapped file, then trim
+    it to what was written. Returns the ID count.
+    The file starts at count_upper_bound() × 14 bytes, capped at MMAP_MAX_INITIAL_BYTES, and
+    doubles whenever the next chunk would not fit, so a wide mask never allocates its whole
+    (mostly unused) upper bound up front.
+    """
+    capacity = min(max(count_upper_bound(mask), 1) * 14, MMAP_MAX_INITIAL_BYTES)
+    total = off = 0
+    with open(path, "w+b") as f:
+        f.truncate(capacity)
+        mm = mmap.mmap(f.fileno(), capacity)
+        try:
+            chunk = bytearray()
+            for sa_id in generate_ids(mask):
+                chunk += sa_id.encode()
+                chunk += b"\n"
+                total += 1
+                if len(chunk) >= OUTPUT_CHUNK_BYTES:
+                    if off + len(chunk) > capacity:
+                        mm.close()
+                        capacity = max(capacity * 2, off + len(chunk))
+                        f.truncate(capacity)
+                        mm = mmap.mmap(f.fileno(), capacity)
+                    mm[off:off + len(chunk)] = chunk
+                    off += len(chunk)
+                    chunk.clear()
+            if off + len(chunk) > capacity:
+                mm.close()
+                capacity = off + len(chunk)
+                f.truncate(capacity)
+                mm = mmap.mmap(f.fileno(), capacity)
+            mm[off:off + len(chunk)] = chunk
+            off += len(chunk)
+            mm.flush()
+        finally:
+            mm.close()
+        f.truncate(off)
+    return total
 
 if __name__ == "__main__":
+    args = sys.argv[1:]
+    if "--out" in args:
+        i = args.index("--out")
+        if i + 1 == len(args) or args[i + 1].startswith("--"):
+            sys.exit("Usage: sa_id_mask_solver.py [--quiet] [--out PATH]  (--out needs a file path)")
+        out_path = args[i + 1]
+        total = write_ids_mmap(out_path, MASK)
+        print(f"Generated {total} IDs that satisfy the mask (written to {out_path}).")
+        sys.exit(0)
+
+    quiet = "--quiet" in args
     total = 0
+    out = sys.stdout.buffer
+    chunk = bytearray()
     for sa_id in generate_ids(MASK):
-        print(sa_id)
         total += 1
+        if quiet:
+            continue
+        chunk += sa_id.encode()
+        chunk += b"\n"
+        if len(chunk) >= OUTPUT_CHUNK_BYTES:     # one write per 64 KiB, not one per ID
+            out.write(chunk)
+            chunk.clear()
+    out.write(chunk)
+    out.flush()
     print(f"\nGenerated {total} IDs that satisfy the mask.")
\ No newline at end of file
@@ -1,21 +1,92 @@
 import os
+import sys
+import io
+import asyncio
+import sqlite3
+import time
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import AsyncOpenAI, RateLimitError, APIConnectionError, InternalServerError
 import json
 
+try:
+    import orjson                     # optional: faster JSONL serialisation
+except ImportError:
+    orjson = None
+
 load_dotenv()  # Loads variables from .env into environment
-client = OpenAI()
+aclient = AsyncOpenAI()
+
+MAX_CONCURRENCY = 50  # upper bound on in-flight requests when predicting many names at once
+_semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+
+# Account limits for the model; the limiter keeps us just under them so 429s don't trigger backoff.
+REQUESTS_PER_MINUTE = 500
+TOKENS_PER_MINUTE = 200_000
+RETRY_ATTEMPTS = 3
+RETRY_DELAY_SECONDS = 5
+
+# The schema answer is ~20 tokens ({"language": ..., "gender": ..., "confidence": ...}).
+MAX_OUTPUT_TOKENS = 40
+
+BATCH_POLL_SECONDS = 30   # how often poll_and_fetch() checks a submitted batch
+BATCH_PRICE_FACTOR = 0.5  # Batch API requests are billed at half the synchronous price
+
+# Predictions are appended to this JSONL file; names already in it are skipped on the next run.
+OUTPUT_JSONL_PATH = os.path.join(os.getcwd(), "person_predictions.jsonl")
+OUTPUT_BUFFER_BYTES = 1 << 20
+
+# Predictions are a pure function of the name, so each (first, last) pair is only sent once:
+# an in-memory dict in front of a small SQLite table that persists across runs.
+CACHE_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "openai_name_cache.sqlite3")
+_cache_db = sqlite3.connect(CACHE_DB_PATH)
+_cache_db.execute("CREATE TABLE IF NOT EXISTS pred (first TEXT, last TEXT, payload TEXT, PRIMARY KEY (first, last))")
+_memory_cache = {}
+cache_stats = {"hits": 0, "misses": 0}
+
+# Token usage and cost for the whole run; summarised once by print_usage_summary().
+usage_totals = {"input_tokens": 0, "output_tokens": 0, "count": 0, "cost_usd": 0.0}
+
+def _cache_key(first_name: str, last_name: str) -> tuple[str, str]:
+    return " ".join(first_name.split()).lower(), " ".join(last_name.split()).lower()
+
+def cache_get(first_name: str, last_name: str):
+    """Cached prediction for the name (marked "cached"), or None."""
+    key = _cache_key(first_name, last_name)
+    payload = _memory_cache.get(key)
+    if payload is None:
+        row = _cache_db.execute("SELECT payload FROM pred WHERE first = ? AND last = ?", key).fetchone()
+        if row:
+            payload = _memory_cache[key] = json.loads(row[0])
+    if payload is None:
+        cache_stats["misses"] += 1
+        return None
+    cache_stats["hits"] += 1
+    return {**payload, "cached": True}
 
-def get_person_prediction(first_name: str, last_name: str):
-    response = client.responses.create(
-        model="gpt-4.1-nano",
-        input=[
+def cache_put(first_name: str, last_name: str, prediction: dict) -> None:
+    key = _cache_key(first_name, last_name)
+    payload = {k: prediction[k] for k in ("language", "gender", "confidence", "model")}
+    _memory_cache[key] = payload
+    _cache_db.execute("INSERT OR REPLACE INTO pred (first, last, payload) VALUES (?, ?, ?)",
+                      (*key, json.dumps(payload)))
+    _cache_db.commit()
+
+# Static prefix of every request, kept byte-identical (pinned model, constant system text, names
+# only in the final user message) so OpenAI's automatic prompt caching can reuse it.
+MODEL = "gpt-4.1-nano"
+SYSTEM_PROMPT = "You are an expert linguist and an expert in name-based gender detection. Given the first name and last name, determine the most likely first language and the most likely gender of the person, assuming they are from South Africa. Respond with only the language name and the gender name, each on its own line, with no additional text, explanation, or formatting."
+
+def build_request_body(first_name: str, last_name: str) -> dict:
+    """Responses API payload for one name; shared by the single-call and Batch API paths."""
+    return {
+        "model": MODEL,
+        "input": [
             {
                 "role": "system",
                 "content": [
                     {
                         "type": "input_text",
-                        "text": "You are an expert linguist and an expert in name-based gender detection. Given the first name and last name, determine the most likely first language and the most likely gender of the person, assuming they are from South Africa. Respond with only the language name and the gender name, each on its own line, with no additional text, explanation, or formatting."
+                        "text": SYSTEM_PROMPT
                     }
                 ]
             },
@@ -29,7 +100,7 @@ def get_person_prediction(first_name: str, last_name: str):
                 ]
             }
         ],
-        text={
+        "text": {
             "format": {
                 "type": "json_schema",
                 "name": "person_prediction",
@@ -76,44 +147,228 @@ def get_person_prediction(first_name: str, last_name: str):
                 }
             }
         },
-        reasoning={},
-        tools=[],
-        temperature=1,
-        max_output_tokens=2048,
-        top_p=1,
-        store=True
-    )
-    return response
+        "reasoning": {},
+        "tools": [],
+        "temperature": 0,  # deterministic "most likely" answer
+        "max_output_tokens": MAX_OUTPUT_TOKENS,
+        "top_p": 1,
+        "store": True
+    }
+
+class RateLimiter:
+    """Two token buckets, requests/min and tokens/min; acquire() waits until both have room."""
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        self.rpm, self.tpm = requests_per_minute, tokens_per_minute
+        self._requests, self._tokens = float(requests_per_minute), float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed, self._updated = now - self._updated, now
+        self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60)
+        self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
+
+    async def acquire(self, tokens: int):
+        tokens = min(tokens, self.tpm)
+        async with self._lock:              # callers are served in arrival order
+            while True:
+                self._refill()
+                if self._requests >= 1 and self._tokens >= tokens:
+                    self._requests -= 1
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep(max((1 - self._requests) * 60 / self.rpm,
+                                        (tokens - self._tokens) * 60 / self.tpm))
+
+rate_limiter = RateLimiter(REQUESTS_PER_MINUTE, TOKENS_PER_MINUTE)
+
+def estimate_tokens(body: dict) -> int:
+    # ~4 characters per token for the prompt, plus the most the model may return
+    return len(json.dumps(body["input"])) // 4 + body["max_output_tokens"]
 
-def print_prediction_with_metadata(first_name, last_name):
-    prediction_response = get_person_prediction(first_name, last_name)
+async def get_person_prediction(first_name: str, last_name: str):
+    # Single request - handy for debugging; use submit_batch() for bulk work.
+    body = build_request_body(first_name, last_name)
+    for attempt in range(RETRY_ATTEMPTS):
+        await rate_limiter.acquire(estimate_tokens(body))
+        try:
+            response = await aclient.responses.create(**body)
+            return response
+        except (RateLimitError, APIConnectionError, InternalServerError) as e:
+            if attempt == RETRY_ATTEMPTS - 1:
+                raise
+            print(f"    Retrying {first_name} {last_name}: {type(e).__name__} (Attempt {attempt + 1}/{RETRY_ATTEMPTS})")
+            await asyncio.sleep(RETRY_DELAY_SECONDS * 2 ** attempt)
+
+def record_usage(input_tokens, output_tokens, price_factor=1.0):
+    # Pricing for gpt-4.1-nano-2025-04-14
+    input_token_price = 0.0000001 * price_factor
+    output_token_price = 0.0000004 * price_factor
+
+    usage_totals["input_tokens"] += input_tokens
+    usage_totals["output_tokens"] += output_tokens
+    usage_totals["count"] += 1
+    usage_totals["cost_usd"] += input_tokens * input_token_price + output_tokens * output_token_price
+
+def print_usage_summary():
+    count = usage_totals["count"]
+    print(f"API calls: {count}, input tokens: {usage_totals['input_tokens']}, "
+          f"output tokens: {usage_totals['output_tokens']}, total cost: ${usage_totals['cost_usd']:.6f}")
+    if count:
+        # Calculate what it would cost if this usage was scaled to 1M calls
+        print(f"Cost per 1M calls at this usage: ${usage_totals['cost_usd'] / count * 1_000_000:,.2f}")
+
+def parse_prediction(text: str, status: str | None = None) -> dict:
+    """Parse the schema JSON; fail loudly if the answer was cut off by MAX_OUTPUT_TOKENS."""
+    try:
+        prediction = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Prediction is not valid JSON (status={status}, "
+                         f"max_output_tokens={MAX_OUTPUT_TOKENS}): {text!r}") from e
+    if status == "incomplete":
+        raise ValueError(f"Prediction was truncated at max_output_tokens={MAX_OUTPUT_TOKENS}: {text!r}")
+    return prediction
+
+async def predict_with_metadata(first_name, last_name):
+    cached = cache_get(first_name, last_name)
+    if cached is not None:
+        return cached
+    async with _semaphore:
+        prediction_response = await get_person_prediction(first_name, last_name)
     prediction_json = prediction_response.output[0].content[0].text
-    prediction = json.loads(prediction_json)
-    # Add model and token info
+    prediction = parse_prediction(prediction_json, prediction_response.status)
     prediction["model"] = prediction_response.model
-    prediction["input_tokens"] = prediction_response.usage.input_tokens
-    prediction["output_tokens"] = prediction_response.usage.output_tokens
+    record_usage(prediction_response.usage.input_tokens, prediction_response.usage.output_tokens)
+    cache_put(first_name, last_name, prediction)
+    return prediction
 
-    # Pricing for gpt-4.1-nano-2025-04-14
-    input_token_price = 0.0000001
-    output_token_price = 0.0000004
-
-    input_cost = prediction["input_tokens"] * input_token_price
-    output_cost = prediction["output_tokens"] * output_token_price
-    prediction["input_cost_usd"] = round(input_cost, 8)
-    prediction["output_cost_usd"] = round(output_cost, 8)
-    prediction["total_cost_usd"] = round(input_cost + output_cost, 8)
-
-    # Calculate what it would cost if this usage was scaled to 1M calls
-    prediction["cost_per_1M_calls_at_this_usage"] = {
-        "input_usd": round(prediction["input_cost_usd"] * 1_000_000, 2),
-        "output_usd": round(prediction["output_cost_usd"] * 1_000_000, 2),
-        "total_usd": round(prediction["total_cost_usd"] * 1_000_000, 2)
-    }
+async def predict_named(first_name, last_name):
+    """predict_with_metadata() tagged with the name; the prediction is None if the call failed."""
+    try:
+        return first_name, last_name, await predict_with_metadata(first_name, last_name)
+    except Exception as e:
+        print(f"    Prediction failed for {first_name} {last_name}: {type(e).__name__}: {e}")
+        return first_name, last_name, None
+
+async def submit_batch(names: list[tuple[str, str]]) -> str:
+    """Upload one /v1/responses request per name as a Batch API job; returns the batch id."""
+    jsonl = "".join(
+        json.dumps({
+            "custom_id": str(i),          # index into `names`
+            "method": "POST",
+            "url": "/v1/responses",
+            "body": build_request_body(first_name, last_name),
+        }) + "\n"
+        for i, (first_name, last_name) in enumerate(names)
+    )
+    batch_file = await aclient.files.create(
+        file=("person_predictions.jsonl", io.BytesIO(jsonl.encode("utf-8"))),
+        purpose="batch",
+    )
+    batch = await aclient.batches.create(
+        input_file_id=batch_file.id,
+        endpoint="/v1/responses",
+        completion_window="24h",
+    )
+    print(f"Submitted batch {batch.id} with {len(names)} requests.")
+    return batch.id
+
+async def poll_and_fetch(batch_id: str) -> dict[int, dict]:
+    """Wait for a batch to finish and return {name index: prediction}."""
+    while True:
+        batch = await aclient.batches.retrieve(batch_id)
+        if batch.status in ("completed", "failed", "expired", "cancelled"):
+            break
+        print(f"Batch {batch_id}: {batch.status} ({batch.request_counts.completed}/{batch.request_counts.total} done)")
+        await asyncio.sleep(BATCH_POLL_SECONDS)
+
+    if batch.status != "completed" or not batch.output_file_id:
+        raise RuntimeError(f"Batch {batch_id} ended with status '{batch.status}'.")
+
+    predictions = {}
+    output = await aclient.files.content(batch.output_file_id)
+    for line in output.text.splitlines():
+        result = json.loads(line)
+        response = result.get("response") or {}
+        if result.get("error") or response.get("status_code") != 200:
+            print(f"Request {result.get('custom_id')} failed: {result.get('error') or response.get('body')}")
+            continue
+        body = response["body"]
+        prediction = parse_prediction(body["output"][0]["content"][0]["text"], body.get("status"))
+        prediction["model"] = body["model"]
+        record_usage(body["usage"]["input_tokens"], body["usage"]["output_tokens"],
+                     price_factor=BATCH_PRICE_FACTOR)
+        predictions[int(result["custom_id"])] = prediction
+    return predictions
+
+def write_prediction(out_fh, first_name, last_name, prediction):
+    record = {"first_name": first_name, "last_name": last_name, **prediction}
+    if orjson is not None:
+        out_fh.write(orjson.dumps(record) + b"\n")
+    else:
+        out_fh.write(json.dumps(record, separators=(",", ":")).encode("utf-8") + b"\n")
+
+def load_processed(path) -> set[tuple[str, str]]:
+    """Normalised (first, last) keys already present in the JSONL output, for resuming."""
+    processed = set()
+    if os.path.exists(path):
+        with open(path, "rb") as fh:
+            for line in fh:
+                if line.strip():
+                    record = json.loads(line)
+                    processed.add(_cache_key(record["first_name"], record["last_name"]))
+    return processed
+
+async def main(names, use_batch=False):
+    processed = load_processed(OUTPUT_JSONL_PATH)
+    names = [(f, l) for f, l in names if _cache_key(f, l) not in processed]
+    if processed:
+        print(f"Resuming: {len(processed)} names already in {OUTPUT_JSONL_PATH}, {len(names)} to go.")
+
+    out_fh = open(OUTPUT_JSONL_PATH, "ab", buffering=OUTPUT_BUFFER_BYTES)
+    written = 0
+    failed = 0
+    try:
+        if use_batch:
+            # Bulk path: only cache misses go into one Batch API job (half price, 24h window).
+            predictions = {i: cache_get(f, l) for i, (f, l) in enumerate(names)}
+            misses = [i for i, prediction in predictions.items() if prediction is None]
+            if misses:
+                fetched = await poll_and_fetch(await submit_batch([names[i] for i in misses]))
+                for j, prediction in fetched.items():
+                    cache_put(*names[misses[j]], prediction)
+                    predictions[misses[j]] = prediction
+            for i in sorted(predictions):
+                if predictions[i] is not None:
+                    write_prediction(out_fh, *names[i], predictions[i])
+                    written += 1
+        else:
+            # All requests go out concurrently; each result is appended and flushed as soon as it
+            # finishes, so an interrupted run keeps everything done so far and the next run resumes.
+            for finished in asyncio.as_completed([predict_named(f, l) for f, l in names]):
+                first_name, last_name, prediction = await finished
+                if prediction is None:
+                    failed += 1
+                    continue
+                write_prediction(out_fh, first_name, last_name, prediction)
+                out_fh.flush()
+                written += 1
+    finally:
+        out_fh.flush()
+        out_fh.close()
 
-    print(json.dumps(prediction, indent=2))
+    print(f"Wrote {written} predictions to {OUTPUT_JSONL_PATH}")
+    if failed:
+        print(f"{failed} predictions failed; run again to retry them.")
+    print(f"Name cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses")
+    print_usage_summary()
 
 # Example usage:
-print_prediction_with_metadata("Kyle", "van der Westhuizen")
-print_prediction_with_metadata("Nomusa", "Dlamini")
-print_prediction_with_metadata("John", "Smith")
+if __name__ == "__main__":
+    asyncio.run(main([
+        ("Kyle", "van der Westhuizen"),
+        ("Nomusa", "Dlamini"),
+        ("John", "Smith"),
+    ], use_batch="--batch" in sys.argv[1:]))
@@ -1,11 +1,21 @@
 import pyodbc
 import os
 from dotenv import load_dotenv
-from openai import AsyncOpenAI # Use AsyncOpenAI for asyncio
+from openai import AsyncOpenAI, RateLimitError # Use AsyncOpenAI for asyncio
 import json
 import asyncio
+import random
+import re
+import sqlite3
+import httpx
 import time # For timing the process
 
+try:
+    import orjson                     # optional: faster parsing of the API responses
+    parse_json = orjson.loads         # orjson.JSONDecodeError subclasses json.JSONDecodeError
+except ImportError:
+    parse_json = json.loads
+
 load_dotenv()
 
 # --- SQL Server Connection Configuration ---
@@ -18,22 +28,23 @@ DB_CONFIG = {
     'TrustServerCertificate': 'yes'
 }
 
-# --- TEMPORARY DEBUG LINE ---
-if DB_CONFIG['pwd']:
-    print(f"DEBUG: Password (first 5 chars from .env): {DB_CONFIG['pwd'][:5]}*****")
-else:
-    print("DEBUG: DB_PASSWORD environment variable is NOT set or loaded correctly in script.")
-# --- END TEMPORARY DEBUG LINE ---
+# Built once; every (re)connect reuses it
+CONN_STR = (
+    f"DRIVER={DB_CONFIG['driver']};"
+    f"SERVER={DB_CONFIG['server']};"
+    f"DATABASE={DB_CONFIG['database']};"
+    f"UID={DB_CONFIG['uid']};"
+    f"PWD={DB_CONFIG['pwd']};"
+    f"TrustServerCertificate={DB_CONFIG['TrustServerCertificate']};"
+)
+DB_QUERY_TIMEOUT_SECONDS = 30
 
-# --- OpenAI API Client Initialization (Async) ---
-try:
-    async_client = AsyncOpenAI()
-except Exception as e:
-    print(f"Error initializing AsyncOpenAI client: {e}. Ensure OPENAI_API_KEY is set.")
-    async_client = None
+# Highest MasterItems.Id whose predictions have been written; a restart resumes after it.
+CHECKPOINT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "enrich_checkpoint.json")
 
 # --- Constants ---
 DB_BATCH_SIZE = 10000      # Number of records to fetch and process in one DB batch
+FETCH_CHUNK_SIZE = 1000    # Rows per fetchmany(); API calls start after the first chunk
 
 # V V V V V V V V V V V V V V V V V V V V V V V V V V V V V V V V V V V V V V V
 # --- NEW VARIABLE: SET THE TOTAL NUMBER OF RECORDS TO PROCESS ---
@@ -44,170 +55,349 @@ MAX_TOTAL_RECORDS_TO_PROCESS = None # Example: 50000 or None
 API_CALL_CONCURRENCY = 2000
 RETRY_ATTEMPTS = 3
 RETRY_DELAY_SECONDS = 5
-INTER_BATCH_DELAY_SECONDS = 2
+NAMES_PER_REQUEST = 25   # names predicted per API call; the system prompt is sent once for all of them
+MAX_OUTPUT_TOKENS_PER_NAME = 40   # one prediction object is ~25 tokens
+
+# --- Account rate limits (see the OpenAI dashboard) ---
+MAX_REQUESTS_PER_MINUTE = 5000
+MAX_TOKENS_PER_MINUTE = 2_000_000
+RATE_LIMIT_PAUSE_SECONDS = 2   # everyone waits this long after a 429
+# When a response reports less headroom than this, calls pause until the limit resets
+LOW_HEADROOM_REQUESTS = 50
+LOW_HEADROOM_TOKENS = 20_000
+
+# Kept short and byte-identical across calls: the same prefix on every request is what
+# lets OpenAI's automatic prompt caching apply.
+SYSTEM_PROMPT = (
+    "Predict the most likely first language and gender of each numbered South African person from their name. "
+    "Return JSON {predictions: [{index, language, gender, confidence}]} with one entry per number; "
+    "confidence is between 0.0 and 1.0."
+)
+
+PREDICTION_RESPONSE_FORMAT = {"type": "json_schema", "json_schema": {"name": "person_predictions", "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "predictions": {"type": "array", "items": {
+                "type": "object",
+                "properties": {
+                    "index": {"type": "integer"},
+                    "language": {"type": "string",
+                                 "enum": ["Afrikaans", "English", "isiNdebele", "isiXhosa", "isiZulu", "Sepedi", "Sesotho", "Setswana", "siSwati", "Tshivenda", "Xitsonga"]},
+                    "gender": {"type": "string", "enum": ["FEMALE", "MALE"]},
+                    "confidence": {"type": "number"}
+                }, "required": ["index", "language", "gender", "confidence"], "additionalProperties": False}}
+        }, "required": ["predictions"], "additionalProperties": False}}}
+
+# --- Local prediction cache ---
+# A prediction depends only on the name, so each (first, last) pair is sent to the API once.
+# The SQLite table persists across runs and is loaded into a dict at startup.
+NAME_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "name_cache.sqlite")
+_name_cache_db = sqlite3.connect(NAME_CACHE_PATH)
+_name_cache_db.execute("CREATE TABLE IF NOT EXISTS names (fn TEXT, ln TEXT, lang TEXT, gender TEXT, PRIMARY KEY (fn, ln))")
+name_cache = {(fn, ln): (lang, gender) for fn, ln, lang, gender in _name_cache_db.execute("SELECT fn, ln, lang, gender FROM names")}
+
+def name_cache_key(first_name: str, last_name: str):
+    return (first_name.lower(), last_name.lower())
+
+def save_to_name_cache(entries):
+    # entries: [((fn, ln), (lang, gender)), ...]; one transaction per batch
+    if not entries:
+        return
+    name_cache.update(entries)
+    _name_cache_db.executemany("INSERT OR REPLACE INTO names (fn, ln, lang, gender) VALUES (?, ?, ?, ?)",
+                               [key + value for key, value in entries])
+    _name_cache_db.commit()
+
+# --- OpenAI API Client Initialization (Async) ---
+# One pooled HTTP client for the whole run, sized so every in-flight call can keep
+# its connection alive instead of paying a new TCP/TLS handshake.
+try:
+    import h2  # noqa: F401 - optional; lets the in-flight calls multiplex over HTTP/2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+try:
+    async_client = AsyncOpenAI(http_client=httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=API_CALL_CONCURRENCY,
+                            max_keepalive_connections=API_CALL_CONCURRENCY,
+                            keepalive_expiry=60.0),
+        timeout=httpx.Timeout(60.0, connect=10.0),
+        http2=HTTP2_AVAILABLE))
+except Exception as e:
+    print(f"Error initializing AsyncOpenAI client: {e}. Ensure OPENAI_API_KEY is set.")
+    async_client = None
+
+# --- Concurrency limit for API calls ---
+# Created on first use so it binds to the running event loop.
+_api_semaphore = None
+
+def get_api_semaphore():
+    global _api_semaphore
+    if _api_semaphore is None:
+        _api_semaphore = asyncio.Semaphore(API_CALL_CONCURRENCY)
+    return _api_semaphore
+
+# --- Proactive rate limiting: requests/min and tokens/min buckets ---
+class TokenBucket:
+    def __init__(self, max_requests_per_minute: int, max_tokens_per_minute: int):
+        self.max_requests_per_minute = max_requests_per_minute
+        self.max_tokens_per_minute = max_tokens_per_minute
+        self.available_request_capacity = float(max_requests_per_minute)
+        self.available_token_capacity = float(max_tokens_per_minute)
+        self.last_update_time = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed, self.last_update_time = now - self.last_update_time, now
+        self.available_request_capacity = min(self.max_requests_per_minute,
+            self.available_request_capacity + elapsed * self.max_requests_per_minute / 60)
+        self.available_token_capacity = min(self.max_tokens_per_minute,
+            self.available_token_capacity + elapsed * self.max_tokens_per_minute / 60)
+
+    def pause(self, seconds: float):
+        # Called on a 429: hold back every caller, not just the one that was rejected.
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def observe(self, headers):
+        # The x-ratelimit-* headers on every response say how much of the account's limit is
+        # left; pause only when it is nearly used up, until the window resets.
+        try:
+            remaining_requests = int(headers.get("x-ratelimit-remaining-requests", LOW_HEADROOM_REQUESTS))
+            remaining_tokens = int(headers.get("x-ratelimit-remaining-tokens", LOW_HEADROOM_TOKENS))
+        except ValueError:
+            return
+        if remaining_requests < LOW_HEADROOM_REQUESTS:
+            self.pause(parse_reset_seconds(headers.get("x-ratelimit-reset-requests")))
+        if remaining_tokens < LOW_HEADROOM_TOKENS:
+            self.pause(parse_reset_seconds(headers.get("x-ratelimit-reset-tokens")))
+
+    async def acquire(self, requests: int, tokens: int):
+        tokens = min(tokens, self.max_tokens_per_minute)
+        async with self._lock:  # callers are served in arrival order
+            while True:
+                wait = self.paused_until - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                    continue
+                self._refill()
+                if self.available_request_capacity >= requests and self.available_token_capacity >= tokens:
+                    self.available_request_capacity -= requests
+                    self.available_token_capacity -= tokens
+                    return
+                await asyncio.sleep(max(
+                    (requests - self.available_request_capacity) * 60 / self.max_requests_per_minute,
+                    (tokens - self.available_token_capacity) * 60 / self.max_tokens_per_minute))
+
+def parse_reset_seconds(value):
+    # OpenAI reset durations look like "1s", "6m0s" or "120ms"
+    units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    parts = re.findall(r"([\d.]+)(ms|s|m|h)", value or "")
+    return sum(float(amount) * units[unit] for amount, unit in parts) if parts else RATE_LIMIT_PAUSE_SECONDS
+
+_token_bucket = None
+
+def get_token_bucket():
+    global _token_bucket
+    if _token_bucket is None:
+        _token_bucket = TokenBucket(MAX_REQUESTS_PER_MINUTE, MAX_TOKENS_PER_MINUTE)
+    return _token_bucket
+
+# Characters sent with every request apart from the names themselves (prompt, schema)
+FIXED_PROMPT_CHARS = len(SYSTEM_PROMPT) + len(json.dumps(PREDICTION_RESPONSE_FORMAT))
+
+def estimate_tokens(user_text: str, name_count: int) -> int:
+    # ~4 characters per token for the prompt, plus the most the model may return
+    return (FIXED_PROMPT_CHARS + len(user_text)) // 4 + MAX_OUTPUT_TOKENS_PER_NAME * name_count
+
+async def predict_group(name_keys, people):
+    # Pairs a call's results with the cache keys of the names it was sent
+    return name_keys, await get_person_predictions_async(people)
+
+async def cancel_calls(tasks):
+    # Cancels the API calls still in flight and waits for them to unwind, so a batch that is
+    # abandoned (and refetched) does not leave calls running or send the same names twice.
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+async def get_person_predictions_async(people):
+    # At most API_CALL_CONCURRENCY calls are in flight; a finished call immediately frees
+    # its slot for the next one, so there is no waiting for the slowest call in a chunk.
+    async with get_api_semaphore():
+        return await _get_person_predictions_with_retries(people)
 
 # --- Asynchronous Prediction Function (Optimized with Retries) ---
-async def get_person_prediction_async(first_name: str, last_name: str, item_id: int):
-    # ... (This function remains the same as in the previous version) ...
+async def _get_person_predictions_with_retries(people):
+    # people: [(item_id, first_name, last_name), ...] - up to NAMES_PER_REQUEST names in one call.
+    # Returns one {"item_id", "prediction"} or {"item_id", "error"} dict per person, in order.
+    def errors_for_all(error_msg):
+        return [{"item_id": item_id, "error": error_msg} for item_id, _, _ in people]
+
     if not async_client:
-        return {"item_id": item_id, "error": "OpenAI client not initialized."}
-    if not first_name or not last_name:
-        return {"item_id": item_id, "error": "Missing first name or last name."}
+        return errors_for_all("OpenAI client not initialized.")
 
+    user_text = "\n".join(f"{n}. first_name: {first_name} last_name: {last_name}"
+                          for n, (_, first_name, last_name) in enumerate(people, 1))
+    est_tokens = estimate_tokens(user_text, len(people))
+    first_id = people[0][0]
     for attempt in range(RETRY_ATTEMPTS):
         raw_response_content = None
         try:
-            response_object = await async_client.responses.create(
+            await get_token_bucket().acquire(1, est_tokens)
+            raw_response = await async_client.chat.completions.with_raw_response.create(
                 model="gpt-4.1-nano",
-                input=[
-                    {
-                        "role": "system",
-                        "content": [{"type": "input_text", "text": (
-                            "You are an expert linguist and an expert in name-based gender detection. "
-                            "Given the first name and last name, determine the most likely first language, "
-                            "gender, and a numerical confidence score for the person, assuming they are from South Africa. "
-                            "Respond with a JSON object strictly adhering to the provided schema. The JSON object must include "
-                            "'language' (chosen from the official South African languages specified in the schema's enum), "
-                            "'gender' (as 'FEMALE' or 'MALE' as specified in the schema's enum), "
-                            "and 'confidence' (a numerical score indicating the confidence level of the prediction, ideally between 0.0 and 1.0)."
-                        )}]
-                    },
-                    {
-                        "role": "user",
-                        "content": [{"type": "input_text", "text": f"first_name: {first_name} last_name: {last_name}"}]
-                    }
+                messages=[
+                    {"role": "system", "content": SYSTEM_PROMPT},
+                    {"role": "user", "content": user_text}
                 ],
-                text={"format": {"type": "json_schema", "name": "person_prediction", "strict": True,
-                      "schema": {
-                          "type": "object",
-                          "properties": {
-                              "language": {"type": "string", "description": "Most likely first language",
-                                           "enum": ["Afrikaans", "English", "isiNdebele", "isiXhosa", "isiZulu", "Sepedi", "Sesotho", "Setswana", "siSwati", "Tshivenda", "Xitsonga"]},
-                              "gender": {"type": "string", "description": "Most likely gender", "enum": ["FEMALE", "MALE"]},
-                              "confidence": {"type": "number", "description": "Prediction confidence (e.g., 0.0 to 1.0)"}
-                          }, "required": ["language", "gender", "confidence"], "additionalProperties": False}}},
-                reasoning={}, tools=[], temperature=0.7, max_output_tokens=150, top_p=1, store=True
+                response_format=PREDICTION_RESPONSE_FORMAT,
+                temperature=0.7, max_tokens=MAX_OUTPUT_TOKENS_PER_NAME * len(people), top_p=1, store=False
             )
-
-            if response_object and response_object.output and response_object.output[0].content:
-                raw_response_content = response_object.output[0].content[0].text
-                prediction_data = json.loads(raw_response_content)
-                return {"item_id": item_id, "prediction": prediction_data}
+            get_token_bucket().observe(raw_response.headers)
+            response_object = raw_response.parse()
+
+            if response_object and response_object.choices and response_object.choices[0].message.content:
+                raw_response_content = response_object.choices[0].message.content
+                predictions = {p.pop("index"): p for p in parse_json(raw_response_content)["predictions"]}
+                return [{"item_id": item_id, "prediction": predictions[n]} if n in predictions
+                        else {"item_id": item_id, "error": "Name missing from the batched response."}
+                        for n, (item_id, _, _) in enumerate(people, 1)]
             else:
                 error_msg = "Unexpected response structure from OpenAI API."
                 if attempt < RETRY_ATTEMPTS - 1:
-                    print(f"    Retrying ID {item_id}: {error_msg} (Attempt {attempt + 1}/{RETRY_ATTEMPTS})")
+                    print(f"    Retrying {len(people)} names from ID {first_id}: {error_msg} (Attempt {attempt + 1}/{RETRY_ATTEMPTS})")
                 else: 
-                    return {"item_id": item_id, "error": error_msg}
+                    return errors_for_all(error_msg)
 
         except json.JSONDecodeError as e:
             error_msg = f"JSONDecodeError: {e}. Raw: {raw_response_content}"
             if attempt < RETRY_ATTEMPTS - 1:
-                print(f"    Retrying ID {item_id}: {error_msg} (Attempt {attempt + 1}/{RETRY_ATTEMPTS})")
+                print(f"    Retrying {len(people)} names from ID {first_id}: {error_msg} (Attempt {attempt + 1}/{RETRY_ATTEMPTS})")
+            else:
+                return errors_for_all(error_msg)
+        except RateLimitError as e:
+            get_token_bucket().pause(RATE_LIMIT_PAUSE_SECONDS)
+            error_msg = f"Rate limited (429): {e}"
+            if attempt < RETRY_ATTEMPTS - 1:
+                print(f"    Retrying {len(people)} names from ID {first_id}: {error_msg} (Attempt {attempt + 1}/{RETRY_ATTEMPTS})")
             else:
-                return {"item_id": item_id, "error": error_msg}
+                return errors_for_all(error_msg)
         except Exception as e: 
             error_msg = f"API Error: {type(e).__name__} - {e}"
             if attempt < RETRY_ATTEMPTS - 1:
-                print(f"    Retrying ID {item_id}: {error_msg} (Attempt {attempt + 1}/{RETRY_ATTEMPTS})")
+                print(f"    Retrying {len(people)} names from ID {first_id}: {error_msg} (Attempt {attempt + 1}/{RETRY_ATTEMPTS})")
             else:
-                return {"item_id": item_id, "error": error_msg}
+                return errors_for_all(error_msg)
         
-        await asyncio.sleep(RETRY_DELAY_SECONDS * (attempt + 1)) 
-    return {"item_id": item_id, "error": "All retry attempts failed."}
+        await asyncio.sleep(RETRY_DELAY_SECONDS * 2 ** attempt + random.uniform(0, 1))
+    return errors_for_all("All retry attempts failed.")
 
 
 # --- Database Connection Function (remains synchronous) ---
 def get_db_connection():
-    # ... (This function remains the same) ...
-    conn = None
     if DB_CONFIG['pwd'] is None:
         print("Error: 'DB_PASSWORD' environment variable is not set.")
         return None
     try:
-        connection_string = (
-            f"DRIVER={DB_CONFIG['driver']};"
-            f"SERVER={DB_CONFIG['server']};"
-            f"DATABASE={DB_CONFIG['database']};"
-            f"UID={DB_CONFIG['uid']};"
-            f"PWD={DB_CONFIG['pwd']};"
-            f"TrustServerCertificate={DB_CONFIG['TrustServerCertificate']};"
-        )
-        conn = pyodbc.connect(connection_string)
+        # Explicit transactions: batch_upsert_predictions commits once per batch
+        conn = pyodbc.connect(CONN_STR, autocommit=False)
+        conn.timeout = DB_QUERY_TIMEOUT_SECONDS
         return conn
     except pyodbc.Error as ex:
         sqlstate = ex.args[0]
         print(f"Database connection error: {sqlstate}. Details: {ex}")
         return None
 
-# --- Batch Database Update Functions (Optimized with MERGE) ---
-def batch_upsert_genders(conn, gender_data_list):
-    # ... (This function remains the same) ...
-    if not conn or not gender_data_list:
-        return 0 
+# --- Batch Database Insert (one TVP call per batch) ---
+# The procedure and the dbo.IdDescTvp type live in migrations/ and must be deployed first.
+# The fetch only selects items still missing a gender or language, so rows are inserted
+# where absent and an existing value is never overwritten.
+TSQL_UPSERT_PREDICTIONS = "{CALL dbo.usp_UpsertPersonPredictions(?, ?)}"
+
+def batch_upsert_predictions(conn, gender_data_list, language_data_list):
+    """
+    Insert both lists in one call and one transaction; returns (genders, languages) inserted,
+    or None if nothing could be written (no connection, or the call failed and was rolled back).
+    """
+    if not (gender_data_list or language_data_list):
+        return 0, 0
+    if not conn:
+        return None
     cursor = None
     try:
         cursor = conn.cursor()
-        cursor.execute("""
-            IF OBJECT_ID('tempdb..#TempGenders') IS NOT NULL DROP TABLE #TempGenders;
-            CREATE TABLE #TempGenders (MasterItemId INT PRIMARY KEY, Description NVARCHAR(50));
-        """)
-        insert_sql = "INSERT INTO #TempGenders (MasterItemId, Description) VALUES (?, ?)"
-        cursor.fast_executemany = True
-        cursor.executemany(insert_sql, gender_data_list)
-        
-        merge_sql = """
-            MERGE dbo.Genders AS target
-            USING #TempGenders AS source ON target.MasterItemId = source.MasterItemId
-            WHEN MATCHED AND target.Description <> source.Description THEN 
-                UPDATE SET target.Description = source.Description
-            WHEN NOT MATCHED BY TARGET THEN 
-                INSERT (MasterItemId, Description) VALUES (source.MasterItemId, source.Description);
-        """
-        rows_affected = cursor.execute(merge_sql).rowcount
+        # Each list of (MasterItemId, Description) rows is bound as a table-valued parameter -
+        # a single round-trip for the batch. An empty list binds as an empty TVP (pyodbc >= 4.0.28).
+        row = cursor.execute(TSQL_UPSERT_PREDICTIONS, gender_data_list, language_data_list).fetchone()
         conn.commit()
-        print(f"    Successfully upserted/merged {len(gender_data_list)} gender records. Rows affected in target: {rows_affected if rows_affected != -1 else 'Unknown (check DB)'}.")
-        return rows_affected if rows_affected != -1 else len(gender_data_list) 
+        print(f"    Successfully inserted {row.GendersInserted} of {len(gender_data_list)} gender and "
+              f"{row.LanguagesInserted} of {len(language_data_list)} language records.")
+        return row.GendersInserted, row.LanguagesInserted
     except pyodbc.Error as ex:
-        print(f"    Error batch upserting genders: {ex}")
+        print(f"    Error batch upserting predictions: {ex}")
         if conn.autocommit == False: conn.rollback()
-        return 0
+        return None
     finally:
         if cursor: cursor.close()
 
-def batch_upsert_languages(conn, language_data_list):
-    # ... (This function remains the same) ...
-    if not conn or not language_data_list:
-        return 0
-    cursor = None
-    try:
-        cursor = conn.cursor()
-        cursor.execute("""
-            IF OBJECT_ID('tempdb..#TempLanguages') IS NOT NULL DROP TABLE #TempLanguages;
-            CREATE TABLE #TempLanguages (MasterItemId INT PRIMARY KEY, Description NVARCHAR(50));
-        """)
-        insert_sql = "INSERT INTO #TempLanguages (MasterItemId, Description) VALUES (?, ?)"
-        cursor.fast_executemany = True
-        cursor.executemany(insert_sql, language_data_list)
-        
-        merge_sql = """
-            MERGE dbo.Languages AS target
-            USING #TempLanguages AS source ON target.MasterItemId = source.MasterItemId
-            WHEN MATCHED AND target.Description <> source.Description THEN 
-                UPDATE SET target.Description = source.Description
-            WHEN NOT MATCHED BY TARGET THEN 
-                INSERT (MasterItemId, Description, DateCreated) VALUES (source.MasterItemId, source.Description, GETDATE());
-        """
-        rows_affected = cursor.execute(merge_sql).rowcount
-        conn.commit()
-        print(f"    Successfully upserted/merged {len(language_data_list)} language records. Rows affected in target: {rows_affected if rows_affected != -1 else 'Unknown (check DB)'}.")
-        return rows_affected if rows_affected != -1 else len(language_data_list)
-    except pyodbc.Error as ex:
-        print(f"    Error batch upserting languages: {ex}")
-        if conn.autocommit == False: conn.rollback()
+# --- Batch Fetch (rows are streamed via fetchmany on a worker thread) ---
+# NOT EXISTS gives an anti-semi-join per item instead of joining every row first. IsNameValid
+# is a persisted "both names present" flag indexed as (IsNameValid, Id), so the Id range is a seek.
+# Indexes / column: migrations/EnrichmentFetchIndexes.sql, migrations/MasterItems_IsNameValid.sql
+FETCH_SQL = """
+    SELECT TOP (?)
+        mi.Id,
+        mi.FullName,
+        mi.Surname
+    FROM
+        dbo.MasterItems AS mi
+    WHERE
+        mi.IsNameValid = 1
+        AND mi.Id > ?
+        AND (NOT EXISTS (SELECT 1 FROM dbo.Genders AS g WHERE g.MasterItemId = mi.Id)
+             OR NOT EXISTS (SELECT 1 FROM dbo.Languages AS l WHERE l.MasterItemId = mi.Id))
+    ORDER BY
+        mi.Id ASC;
+"""
+
+def ensure_connection(conn):
+    # Reuse conn while it still answers a trivial probe; otherwise replace it (None on failure).
+    if conn is not None:
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return conn
+        except pyodbc.Error as ex:
+            print(f"  Database connection lost ({ex}); reconnecting...")
+            try:
+                conn.close()
+            except pyodbc.Error:
+                pass
+    return get_db_connection()
+
+def load_checkpoint():
+    if not os.path.exists(CHECKPOINT_PATH):
         return 0
-    finally:
-        if cursor: cursor.close()
+    with open(CHECKPOINT_PATH, encoding="utf-8") as f:
+        return json.load(f)["last_id"]
+
+def save_checkpoint(last_id):
+    # Write-then-rename so a crash mid-write never leaves a truncated checkpoint
+    tmp_path = CHECKPOINT_PATH + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"last_id": last_id}, f)
+    os.replace(tmp_path, CHECKPOINT_PATH)
+
+def upsert_and_checkpoint(conn, gender_data_list, language_data_list, last_id, advance_checkpoint):
+    # Runs on a worker thread; the checkpoint only moves once the batch has been committed, and
+    # never after an earlier batch of this run failed to save (a restart must retry that batch).
+    result = batch_upsert_predictions(conn, gender_data_list, language_data_list)
+    if result is not None and advance_checkpoint:
+        save_checkpoint(last_id)
+    return result
 
 # --- Main Asynchronous Processing Function for Batches ---
 async def process_master_items_in_batches_async():
@@ -215,7 +405,7 @@ async def process_master_items_in_batches_async():
         print("Cannot proceed: AsyncOpenAI client failed to initialize.")
         return
 
-    last_processed_id = 0 
+    last_processed_id = load_checkpoint()
     # RENAMED and USED for MAX_TOTAL_RECORDS_TO_PROCESS logic
     cumulative_records_fetched_for_processing = 0 
     total_api_predictions_successful = 0
@@ -223,12 +413,20 @@ async def process_master_items_in_batches_async():
     total_genders_upserted = 0
     total_languages_upserted = 0
     batch_number = 0
+    pending_upsert = None  # background upsert of the previous batch
+    checkpoint_blocked = False  # set once a batch fails to save or has API errors; the checkpoint stays before it
+    # Two connections for the whole run: one for the SELECTs, one owned by the background
+    # upsert (a pyodbc connection must not be used from two threads at once).
+    fetch_conn = None
+    write_conn = None
 
     if MAX_TOTAL_RECORDS_TO_PROCESS is not None and MAX_TOTAL_RECORDS_TO_PROCESS <= 0:
         print(f"MAX_TOTAL_RECORDS_TO_PROCESS is set to {MAX_TOTAL_RECORDS_TO_PROCESS}. No records will be processed.")
         return
 
     print(f"Starting data enrichment process. DB Batch Size: {DB_BATCH_SIZE}, API Concurrency: {API_CALL_CONCURRENCY}")
+    if last_processed_id:
+        print(f"Resuming after ID {last_processed_id} (from {CHECKPOINT_PATH}).")
     if MAX_TOTAL_RECORDS_TO_PROCESS is not None:
         print(f"Maximum total records to process in this run: {MAX_TOTAL_RECORDS_TO_PROCESS}")
     else:
@@ -258,41 +456,67 @@ async def process_master_items_in_batches_async():
         print(f"  Attempting to fetch up to {records_to_fetch_this_batch} records for this batch.")
         start_time_batch_overall = time.time()
         
-        conn = get_db_connection()
-        if not conn:
+        fetch_conn = await asyncio.to_thread(ensure_connection, fetch_conn)
+        if not fetch_conn:
             print(f"Failed to get DB connection for Batch {batch_number}. Retrying in 60s...")
             await asyncio.sleep(60)
             continue
         
-        print(f"  Successfully connected to database for Batch {batch_number}.")
         fetch_cursor = None
         rows_in_current_batch = [] # To store actual fetched rows
+        tasks = []
         
         try:
-            fetch_cursor = conn.cursor()
-            query = f"""
-                SELECT TOP (?)
-                    mi.Id,
-                    mi.FullName,
-                    mi.Surname
-                FROM
-                    dbo.MasterItems AS mi
-                LEFT JOIN
-                    dbo.Genders AS g ON mi.Id = g.MasterItemId
-                LEFT JOIN
-                    dbo.Languages AS l ON mi.Id = l.MasterItemId
-                WHERE
-                    (g.MasterItemId IS NULL OR l.MasterItemId IS NULL) 
-                    AND mi.Id > ? 
-                    AND mi.FullName IS NOT NULL
-                    AND LTRIM(RTRIM(mi.FullName)) <> ''
-                    AND mi.Surname IS NOT NULL
-                    AND LTRIM(RTRIM(mi.Surname)) <> ''
-                ORDER BY
-                    mi.Id ASC;
-            """
-            fetch_cursor.execute(query, records_to_fetch_this_batch, last_processed_id)
-            rows_in_current_batch = fetch_cursor.fetchall()
+            fetch_cursor = fetch_conn.cursor()
+            fetch_cursor.arraysize = FETCH_CHUNK_SIZE
+            await asyncio.to_thread(fetch_cursor.execute, FETCH_SQL, records_to_fetch_this_batch, last_processed_id)
+
+            # Tasks are created as each chunk arrives, so the first API calls are already
+            # running while the rest of the batch is still being fetched.
+            names_sent = 0
+            group_name_keys = []    # name keys of people_to_predict, in the same order
+            people_to_predict = []  # names waiting for the next NAMES_PER_REQUEST-sized call
+            item_ids_by_name = {}  # name key -> every item_id in this batch with that name
+            genders_to_upsert = []
+            languages_to_upsert = []
+            current_batch_cache_hits = 0
+            while chunk := await asyncio.to_thread(fetch_cursor.fetchmany):
+                rows_in_current_batch.extend(chunk)
+                for db_row_data in chunk:
+                    item_id, full_name, surname = db_row_data
+                    # FETCH_SQL already excludes NULL and blank names, so both are non-empty str here;
+                    # strip() only removes leading/trailing padding.
+                    processed_full_name = full_name.strip()
+                    processed_surname = surname.strip()
+
+                    if not processed_full_name or not processed_surname:
+                        print(f"    Skipping ID: {item_id} due to missing name components.")
+                        continue
+                    key = name_cache_key(processed_full_name, processed_surname)
+                    cached = name_cache.get(key)
+                    if cached:
+                        # Seen this name before - reuse the prediction, no API call
+                        current_batch_cache_hits += 1
+                        cached_language, cached_gender = cached
+                        if cached_gender:
+                            genders_to_upsert.append((item_id, cached_gender))
+                        if cached_language:
+                            languages_to_upsert.append((item_id, cached_language))
+                        continue
+                    if key in item_ids_by_name:
+                        # Same name already has a call in flight this batch - share its result
+                        item_ids_by_name[key].append(item_id)
+                        continue
+                    item_ids_by_name[key] = [item_id]
+                    group_name_keys.append(key)
+                    people_to_predict.append((item_id, processed_full_name, processed_surname))
+                    if len(people_to_predict) == NAMES_PER_REQUEST:
+                        tasks.append(asyncio.create_task(predict_group(group_name_keys, people_to_predict)))
+                        names_sent += len(people_to_predict)
+                        group_name_keys, people_to_predict = [], []
+            if people_to_predict:
+                tasks.append(asyncio.create_task(predict_group(group_name_keys, people_to_predict)))
+                names_sent += len(people_to_predict)
             
             if not rows_in_current_batch:
                 print("No more records to process that meet the criteria from the database.")
@@ -301,73 +525,80 @@ async def process_master_items_in_batches_async():
             print(f"  Fetched {len(rows_in_current_batch)} records in Batch {batch_number} for API processing.")
             # This counter tracks records *selected* from DB for processing in this run
             cumulative_records_fetched_for_processing += len(rows_in_current_batch) 
-            
-            tasks = []
-            for db_row_data in rows_in_current_batch:
-                item_id, full_name, surname = db_row_data
-                processed_full_name = full_name.strip() if isinstance(full_name, str) else ""
-                processed_surname = surname.strip() if isinstance(surname, str) else ""
-
-                if not processed_full_name or not processed_surname:
-                    print(f"    Skipping ID: {item_id} due to missing name components.")
-                    continue
-                tasks.append(get_person_prediction_async(processed_full_name, processed_surname, item_id))
+            if current_batch_cache_hits:
+                print(f"  {current_batch_cache_hits} records in Batch {batch_number} answered from the local name cache.")
+            current_batch_shared = sum(map(len, item_ids_by_name.values())) - len(item_ids_by_name)
+            if current_batch_shared:
+                print(f"  {current_batch_shared} records in Batch {batch_number} share an API call with a same-named record.")
 
-            if not tasks:
+            if not tasks and not genders_to_upsert and not languages_to_upsert:
                 print(f"  No valid API tasks created for Batch {batch_number}. Moving to next potential batch.")
                 if rows_in_current_batch: last_processed_id = rows_in_current_batch[-1].Id 
                 if fetch_cursor: fetch_cursor.close()
-                if conn: conn.close()
                 print(f"  Updated last_processed_id to: {last_processed_id}")
-                if INTER_BATCH_DELAY_SECONDS > 0: await asyncio.sleep(INTER_BATCH_DELAY_SECONDS)
                 continue
             
-            print(f"  Processing {len(tasks)} API calls concurrently for Batch {batch_number}...")
+            print(f"  Processing {len(tasks)} API calls ({names_sent} names) concurrently for Batch {batch_number}...")
             start_time_api_calls = time.time()
-            api_results = []
-            for i in range(0, len(tasks), API_CALL_CONCURRENCY):
-                chunk = tasks[i:i+API_CALL_CONCURRENCY]
-                api_results.extend(await asyncio.gather(*chunk))
-                if len(tasks) > API_CALL_CONCURRENCY and i + API_CALL_CONCURRENCY < len(tasks):
-                    print(f"    Processed {len(api_results)}/{len(tasks)} API calls for current DB batch, brief pause...")
-                    await asyncio.sleep(1) 
-            api_calls_duration = time.time() - start_time_api_calls
-            print(f"  API calls for Batch {batch_number} completed in {api_calls_duration:.2f}s.")
-
-            genders_to_upsert = []
-            languages_to_upsert = []
             current_batch_api_success = 0
             current_batch_api_errors = 0
-
-            for result in api_results:
-                item_id = result["item_id"]
-                if "prediction" in result:
-                    current_batch_api_success +=1
-                    prediction = result["prediction"]
-                    predicted_gender = prediction.get("gender")
-                    predicted_language = prediction.get("language")
-                    
-                    if predicted_gender:
-                        genders_to_upsert.append((item_id, predicted_gender))
-                    if predicted_language:
-                        languages_to_upsert.append((item_id, predicted_language))
-                else:
-                    current_batch_api_errors += 1
-                    print(f"    API Error for ID {item_id} in Batch {batch_number}: {result.get('error', 'Unknown error')}")
+            first_errored_id = None  # lowest item_id in this batch without a prediction
+            new_cache_entries = []
+
+            # Each call's results are turned into upsert rows as soon as it finishes, while
+            # the other calls are still in flight, rather than in one pass after the last one.
+            # The semaphore in get_person_predictions_async keeps API_CALL_CONCURRENCY calls in flight
+            for finished_call in asyncio.as_completed(tasks):
+                name_keys, call_results = await finished_call
+                for key, result in zip(name_keys, call_results):
+                    if "prediction" in result:
+                        current_batch_api_success += 1
+                        prediction = result["prediction"]
+                        predicted_gender = prediction.get("gender")
+                        predicted_language = prediction.get("language")
+                        new_cache_entries.append((key, (predicted_language, predicted_gender)))
+
+                        shared_item_ids = item_ids_by_name[key]
+                        if predicted_gender:
+                            genders_to_upsert.extend([(shared_item_id, predicted_gender) for shared_item_id in shared_item_ids])
+                        if predicted_language:
+                            languages_to_upsert.extend([(shared_item_id, predicted_language) for shared_item_id in shared_item_ids])
+                    else:
+                        current_batch_api_errors += 1
+                        print(f"    API Error for ID {result['item_id']} in Batch {batch_number}: {result.get('error', 'Unknown error')}")
+                        errored_id = min(item_ids_by_name[key])
+                        if first_errored_id is None or errored_id < first_errored_id:
+                            first_errored_id = errored_id
+            api_calls_duration = time.time() - start_time_api_calls
+            print(f"  API calls for Batch {batch_number} completed in {api_calls_duration:.2f}s.")
             
             total_api_predictions_successful += current_batch_api_success
             total_api_errors += current_batch_api_errors
-
-            if genders_to_upsert:
-                affected_g = batch_upsert_genders(conn, genders_to_upsert)
-                total_genders_upserted += affected_g if isinstance(affected_g, int) else len(genders_to_upsert) 
-            if languages_to_upsert:
-                affected_l = batch_upsert_languages(conn, languages_to_upsert)
-                total_languages_upserted += affected_l if isinstance(affected_l, int) else len(languages_to_upsert)
-
+            save_to_name_cache(new_cache_entries)
+
+            # Upserts run in the background on the write connection, so the inserts overlap
+            # the next batch's SELECT and API calls. At most one batch is upserting at a time.
+            if pending_upsert:
+                previous_upsert, pending_upsert = pending_upsert, None
+                upserted = await previous_upsert
+                if upserted is None:
+                    checkpoint_blocked = True
+                else:
+                    total_genders_upserted += upserted[0]
+                    total_languages_upserted += upserted[1]
+            write_conn = await asyncio.to_thread(ensure_connection, write_conn)
+            if not write_conn:
+                print(f"  No DB connection for writing Batch {batch_number}; its predictions were not saved.")
             if rows_in_current_batch: last_processed_id = rows_in_current_batch[-1].Id 
+            # FETCH_SQL only reads Ids after the checkpoint, so a restart would never retry a name
+            # the API failed on: stop the checkpoint just before the first one, and hold it there.
+            checkpoint_id = last_processed_id if first_errored_id is None else first_errored_id - 1
+            pending_upsert = asyncio.create_task(asyncio.to_thread(
+                upsert_and_checkpoint, write_conn, genders_to_upsert, languages_to_upsert, checkpoint_id,
+                not checkpoint_blocked))
+            if first_errored_id is not None:
+                checkpoint_blocked = True
             print(f"  Updated last_processed_id to: {last_processed_id}")
-            # TODO: For true resumability across script restarts, persistently save last_processed_id here.
 
             batch_overall_duration = time.time() - start_time_batch_overall
             print(f"--- Batch {batch_number} completed in {batch_overall_duration:.2f}s. ---")
@@ -377,20 +608,33 @@ async def process_master_items_in_batches_async():
 
         except pyodbc.Error as db_ex:
             print(f"Database error during Batch {batch_number} processing: {db_ex}. Check connection and query.")
+            await cancel_calls(tasks)
             await asyncio.sleep(30) 
         except Exception as e:
             print(f"Unexpected error in Batch {batch_number} processing loop: {e}")
+            await cancel_calls(tasks)
             await asyncio.sleep(10)
         finally:
             if fetch_cursor:
                 fetch_cursor.close()
-            if conn:
-                conn.close()
-                print(f"  Database connection for Batch {batch_number} closed.")
-        
-        if INTER_BATCH_DELAY_SECONDS > 0 and rows_in_current_batch: 
-            print(f"Pausing for {INTER_BATCH_DELAY_SECONDS}s before next batch...")
-            await asyncio.sleep(INTER_BATCH_DELAY_SECONDS)
+        # No fixed pause between batches: the token bucket throttles the API calls themselves,
+        # and pauses them only when the rate-limit headers show the account is nearly out of headroom.
+
+    if pending_upsert:
+        previous_upsert, pending_upsert = pending_upsert, None
+        upserted = await previous_upsert
+        if upserted is None:
+            checkpoint_blocked = True
+        else:
+            total_genders_upserted += upserted[0]
+            total_languages_upserted += upserted[1]
+    if checkpoint_blocked:
+        print(f"Some records were not saved or got no prediction; the checkpoint in {CHECKPOINT_PATH} stops "
+              "before the first of them, so the next run retries them.")
+    for conn in (fetch_conn, write_conn):
+        if conn:
+            conn.close()
+    print("Database connections closed.")
 
     print("\n--- Overall Processing Summary ---")
     final_batch_count = batch_number -1 if not rows_in_current_batch and batch_number > 0 else batch_number 
@@ -398,17 +642,24 @@ async def process_master_items_in_batches_async():
     print(f"Total records selected from DB for processing in this run: {cumulative_records_fetched_for_processing}")
     print(f"Total successful API predictions: {total_api_predictions_successful}")
     print(f"Total API errors encountered: {total_api_errors}")
-    print(f"Total gender records effectively upserted/merged: {total_genders_upserted}")
-    print(f"Total language records effectively upserted/merged: {total_languages_upserted}")
+    print(f"Total gender records inserted: {total_genders_upserted}")
+    print(f"Total language records inserted: {total_languages_upserted}")
     print("Processing finished.")
 
 
+async def main():
+    try:
+        await process_master_items_in_batches_async()
+    finally:
+        await async_client.close()  # releases the pooled connections on the running loop
+
+
 if __name__ == "__main__":
     if not async_client:
         print("Exiting: AsyncOpenAI client failed to initialize.")
     else:
         try:
-            asyncio.run(process_master_items_in_batches_async())
+            asyncio.run(main())
         except KeyboardInterrupt:
             print("\nProcess interrupted by user. Exiting.")
         except Exception as e:
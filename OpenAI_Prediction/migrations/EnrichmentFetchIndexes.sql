@@ -0,0 +1,26 @@
+-- Indexes behind the batch fetch in enrich_and_update_master_items.py: the NOT EXISTS
+-- probes seek on MasterItemId. (The Id range itself is covered by IX_MasterItems_IsNameValid,
+-- see MasterItems_IsNameValid.sql.)
+-- Description is INCLUDEd so the Genders / Languages lookups in Random/fetch_enriched_people_data.py
+-- are covered too - a seek per row, no key lookups.
+-- Re-running upgrades an existing key-only index in place (DROP_EXISTING).
+-- Deploy: sqlcmd -S . -d sa_database_enrichment -i EnrichmentFetchIndexes.sql
+IF NOT EXISTS (SELECT 1 FROM sys.indexes
+               WHERE name = 'IX_Genders_MasterItemId' AND object_id = OBJECT_ID('dbo.Genders'))
+    CREATE NONCLUSTERED INDEX IX_Genders_MasterItemId ON dbo.Genders (MasterItemId) INCLUDE (Description);
+ELSE IF NOT EXISTS (SELECT 1 FROM sys.indexes AS i
+                    JOIN sys.index_columns AS ic ON ic.object_id = i.object_id AND ic.index_id = i.index_id
+                    WHERE i.name = 'IX_Genders_MasterItemId' AND i.object_id = OBJECT_ID('dbo.Genders')
+                      AND ic.is_included_column = 1 AND COL_NAME(ic.object_id, ic.column_id) = 'Description')
+    CREATE NONCLUSTERED INDEX IX_Genders_MasterItemId ON dbo.Genders (MasterItemId) INCLUDE (Description)
+        WITH (DROP_EXISTING = ON);
+
+IF NOT EXISTS (SELECT 1 FROM sys.indexes
+               WHERE name = 'IX_Languages_MasterItemId' AND object_id = OBJECT_ID('dbo.Languages'))
+    CREATE NONCLUSTERED INDEX IX_Languages_MasterItemId ON dbo.Languages (MasterItemId) INCLUDE (Description);
+ELSE IF NOT EXISTS (SELECT 1 FROM sys.indexes AS i
+                    JOIN sys.index_columns AS ic ON ic.object_id = i.object_id AND ic.index_id = i.index_id
+                    WHERE i.name = 'IX_Languages_MasterItemId' AND i.object_id = OBJECT_ID('dbo.Languages')
+                      AND ic.is_included_column = 1 AND COL_NAME(ic.object_id, ic.column_id) = 'Description')
+    CREATE NONCLUSTERED INDEX IX_Languages_MasterItemId ON dbo.Languages (MasterItemId) INCLUDE (Description)
+        WITH (DROP_EXISTING = ON);
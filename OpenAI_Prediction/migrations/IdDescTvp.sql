@@ -0,0 +1,9 @@
+-- dbo.IdDescTvp
+-- (MasterItemId, Description) rows passed as a table-valued parameter to
+-- dbo.usp_UpsertPersonPredictions.
+-- Deploy before the procedure: sqlcmd -S . -d sa_database_enrichment -i IdDescTvp.sql
+IF TYPE_ID('dbo.IdDescTvp') IS NULL
+    CREATE TYPE dbo.IdDescTvp AS TABLE (
+        MasterItemId INT PRIMARY KEY,
+        Description  NVARCHAR(50)
+    );
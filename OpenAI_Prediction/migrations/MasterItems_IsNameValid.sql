@@ -0,0 +1,22 @@
+-- dbo.MasterItems.IsNameValid
+-- Persisted "FullName and Surname both present" flag, indexed as (flag, Id), so the batch
+-- fetch in enrich_and_update_master_items.py is a range seek on (1, Id > @last) and
+-- Random/check_missing_names.py counts IsNameValid = 0 from the index alone.
+-- A plain <> '' treats all-blank names as empty: trailing spaces are ignored when comparing.
+-- Deploy: sqlcmd -S . -d sa_database_enrichment -i MasterItems_IsNameValid.sql
+-- An index on a computed column needs QUOTED_IDENTIFIER / ANSI_NULLS ON; sqlcmd defaults the former to OFF.
+SET ANSI_NULLS ON;
+SET QUOTED_IDENTIFIER ON;
+GO
+
+IF COL_LENGTH('dbo.MasterItems', 'IsNameValid') IS NULL
+    ALTER TABLE dbo.MasterItems ADD IsNameValid AS
+        (CASE WHEN FullName IS NOT NULL AND FullName <> ''
+               AND Surname IS NOT NULL AND Surname <> '' THEN 1 ELSE 0 END) PERSISTED;
+GO
+
+IF NOT EXISTS (SELECT 1 FROM sys.indexes
+               WHERE name = 'IX_MasterItems_IsNameValid' AND object_id = OBJECT_ID('dbo.MasterItems'))
+    CREATE NONCLUSTERED INDEX IX_MasterItems_IsNameValid
+        ON dbo.MasterItems (IsNameValid, Id) INCLUDE (FullName, Surname);
+GO
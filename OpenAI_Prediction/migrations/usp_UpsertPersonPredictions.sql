@@ -0,0 +1,40 @@
+-- dbo.usp_UpsertPersonPredictions
+-- Insert the predicted genders and languages for one batch in a single transaction.
+-- MasterItems that already have a gender / language are left alone.
+-- Returns the number of gender and language rows inserted.
+-- Called by enrich_and_update_master_items.py.
+-- Deploy: sqlcmd -S . -d sa_database_enrichment -i usp_UpsertPersonPredictions.sql
+-- A procedure keeps the SET options it was created with. QUOTED_IDENTIFIER / ANSI_NULLS must be ON
+-- for its INSERTs to run once Genders / Languages back an indexed view (Random/migrations/vEnrichedPeople.sql);
+-- sqlcmd defaults QUOTED_IDENTIFIER to OFF, hence the explicit SETs.
+SET ANSI_NULLS ON;
+SET QUOTED_IDENTIFIER ON;
+GO
+
+CREATE OR ALTER PROCEDURE dbo.usp_UpsertPersonPredictions
+    @Genders   dbo.IdDescTvp READONLY,
+    @Languages dbo.IdDescTvp READONLY
+AS
+BEGIN
+    SET NOCOUNT ON;
+    SET XACT_ABORT ON;
+    DECLARE @gendersInserted INT, @languagesInserted INT;
+
+    BEGIN TRAN;
+
+    INSERT INTO dbo.Genders (MasterItemId, Description)
+    SELECT r.MasterItemId, r.Description
+    FROM   @Genders AS r
+    WHERE  NOT EXISTS (SELECT 1 FROM dbo.Genders AS g WHERE g.MasterItemId = r.MasterItemId);
+    SET @gendersInserted = @@ROWCOUNT;
+
+    INSERT INTO dbo.Languages (MasterItemId, Description, DateCreated)
+    SELECT r.MasterItemId, r.Description, GETDATE()
+    FROM   @Languages AS r
+    WHERE  NOT EXISTS (SELECT 1 FROM dbo.Languages AS l WHERE l.MasterItemId = r.MasterItemId);
+    SET @languagesInserted = @@ROWCOUNT;
+
+    COMMIT;
+
+    SELECT @gendersInserted AS GendersInserted, @languagesInserted AS LanguagesInserted;
+END
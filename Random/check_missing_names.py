@@ -15,14 +15,6 @@ DB_CONFIG = {
     'TrustServerCertificate': 'yes'
 }
 
-# --- TEMPORARY DEBUG LINE ---
-# REMOVE THIS LINE AFTER DEBUGGING FOR SECURITY!
-if DB_CONFIG['pwd']:
-    print(f"DEBUG: Password (first 5 chars from .env): {DB_CONFIG['pwd'][:5]}*****")
-else:
-    print("DEBUG: DB_PASSWORD environment variable is NOT set or loaded correctly in script.")
-# --- END TEMPORARY DEBUG LINE ---
-
 def get_db_connection():
     """
     Establishes and returns a pyodbc connection to the SQL Server database.
@@ -62,12 +54,13 @@ def count_records_with_missing_name_parts(conn):
         print("No active database connection to execute the count.")
         return None
 
-    # Query to count records where either FullName or Surname is missing
+    # Query to count records where either FullName or Surname is missing.
+    # IsNameValid is a persisted, indexed flag (OpenAI_Prediction/migrations/MasterItems_IsNameValid.sql),
+    # so this is answered from IX_MasterItems_IsNameValid instead of trimming every row.
     query = """
     SELECT COUNT(*) AS MissingNamePartCount
     FROM dbo.MasterItems
-    WHERE (FullName IS NULL OR LTRIM(RTRIM(FullName)) = '')
-       OR (Surname IS NULL OR LTRIM(RTRIM(Surname)) = '');
+    WHERE IsNameValid = 0;
     """
     
     cursor = None
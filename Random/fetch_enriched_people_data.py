@@ -1,6 +1,15 @@
 import pyodbc
 import os # Import the os module to access environment variables
+import sys
 from dotenv import load_dotenv # Make sure this is imported
+import queue
+from collections import namedtuple
+from contextlib import contextmanager
+
+try:
+    import pandas as pd               # optional: only fetch_first_people_frame() needs it
+except ImportError:
+    pd = None
 
 load_dotenv() # Load .env variables at the very beginning of the script
 
@@ -13,17 +22,23 @@ DB_CONFIG = {
     'database': 'sa_database_enrichment',       # UPDATED based on your database structure image
     'uid': 'KC',                                # Matches the 'Login' from your SSMS screenshot
     'pwd': os.environ.get('DB_PASSWORD'),       # <<< NOW FETCHED FROM ENVIRONMENT VARIABLE
-    'TrustServerCertificate': 'yes'             # Added based on 'Trust server certificate' being checked
+    'TrustServerCertificate': 'yes',            # Added based on 'Trust server certificate' being checked
+    'MARS_Connection': 'yes'                    # Lets other statements run while a streamed result is still open
 }
 
-# --- TEMPORARY DEBUG LINE ---
-# This will print the first few characters of the password to confirm it's being read.
-# REMOVE THIS LINE AFTER DEBUGGING FOR SECURITY!
-if DB_CONFIG['pwd']:
-    print(f"DEBUG: Password (first 5 chars from .env): {DB_CONFIG['pwd'][:5]}*****")
-else:
-    print("DEBUG: DB_PASSWORD environment variable is NOT set or loaded correctly in script.")
-# --- END TEMPORARY DEBUG LINE ---
+# Rows per fetchmany(); only this many rows are held in memory at a time while streaming
+FETCH_ARRAYSIZE = 500
+
+# Connection string built once at import from DB_CONFIG; get_db_connection() reuses it
+CONN_STR = (
+    f"DRIVER={DB_CONFIG['driver']};"
+    f"SERVER={DB_CONFIG['server']};"
+    f"DATABASE={DB_CONFIG['database']};"
+    f"UID={DB_CONFIG['uid']};"
+    f"PWD={DB_CONFIG['pwd']};"
+    f"TrustServerCertificate={DB_CONFIG['TrustServerCertificate']};" # Include this for trusted connections
+    f"MARS_Connection={DB_CONFIG['MARS_Connection']};"
+)
 
 def get_db_connection():
     """
@@ -37,17 +52,12 @@ def get_db_connection():
             print("Error: 'DB_PASSWORD' environment variable is not set. Please set it before running the script.")
             return None
 
-        # Construct the connection string from the DB_CONFIG dictionary
-        # Added TrustServerCertificate to the connection string
-        connection_string = (
-            f"DRIVER={DB_CONFIG['driver']};"
-            f"SERVER={DB_CONFIG['server']};"
-            f"DATABASE={DB_CONFIG['database']};"
-            f"UID={DB_CONFIG['uid']};"
-            f"PWD={DB_CONFIG['pwd']};"
-            f"TrustServerCertificate={DB_CONFIG['TrustServerCertificate']};" # Include this for trusted connections
-        )
-        conn = pyodbc.connect(connection_string)
+        # Read-only script: autocommit means no implicit transaction is left open around the SELECT
+        conn = pyodbc.connect(CONN_STR, autocommit=True)
+        # NVARCHAR columns arrive from the SQL Server driver as UTF-16LE; pinning that codec keeps pyodbc
+        # on its built-in UTF-16 decoder for every name / description (UTF-8 here would garble them)
+        conn.setdecoding(pyodbc.SQL_WCHAR, encoding='utf-16le')
+        conn.setencoding(encoding='utf-16le')
         print("Successfully connected to the database!")
         return conn
     except pyodbc.Error as ex:
@@ -55,78 +65,167 @@ def get_db_connection():
         print(f"Database connection error: {sqlstate}. Details: {ex}")
         return None
 
+# --- Connection pool ---
+# Connections are borrowed with acquire() and handed back instead of closed, so a caller that
+# runs these helpers repeatedly (a web handler, a batch job) pays the login handshake once.
+POOL_MAX_SIZE = 20
+_pool = queue.LifoQueue(maxsize=POOL_MAX_SIZE)
+# One long-lived cursor per pooled connection. pyodbc skips SQLPrepare when a cursor re-executes the
+# SQL text it ran last, so repeat calls reuse the prepared statement instead of preparing it again.
+_cursors = {}
+
+def statement_cursor(conn):
+    """Returns conn's cached cursor, creating it (with FETCH_ARRAYSIZE) on first use."""
+    cursor = _cursors.get(conn)
+    if cursor is None:
+        cursor = _cursors[conn] = conn.cursor()
+        cursor.arraysize = FETCH_ARRAYSIZE
+    return cursor
+
+def discard_connection(conn):
+    """Forgets conn's cached cursor and closes the connection (which closes the cursor too)."""
+    _cursors.pop(conn, None)
+    try:
+        conn.close()
+    except pyodbc.Error:
+        pass
+
+def ensure_connection(conn):
+    # Reuse conn while it still answers a trivial probe; otherwise replace it (None on failure).
+    if conn is not None:
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return conn
+        except pyodbc.Error as ex:
+            print(f"Database connection lost ({ex}); reconnecting...")
+            discard_connection(conn)
+    return get_db_connection()
+
+@contextmanager
+def acquire():
+    """
+    Yields an idle pooled connection, or a new one from get_db_connection() (None if that fails).
+    An idle connection is checked with a SELECT 1 first and replaced if the server dropped it.
+    The connection goes back to the pool on exit; it is closed if the pool is already full.
+    """
+    try:
+        conn = _pool.get_nowait()
+    except queue.Empty:
+        conn = None
+    conn = ensure_connection(conn)
+    try:
+        yield conn
+    finally:
+        if conn is not None:
+            try:
+                _pool.put_nowait(conn)
+            except queue.Full:
+                discard_connection(conn)
+
+def close_pool():
+    """Closes every idle pooled connection."""
+    while True:
+        try:
+            discard_connection(_pool.get_nowait())
+        except queue.Empty:
+            break
+
+# SQL query to select Id, FullName, Surname, Gender (from dbo.Genders), and Language (from dbo.Languages)
+# using OUTER APPLY TOP 1 to include gender and language descriptions: people without a prediction
+# still appear (NULL), and a duplicate Genders / Languages row cannot multiply a person's row.
+# Each apply is one seek on IX_Genders_MasterItemId / IX_Languages_MasterItemId INCLUDE (Description)
+# (OpenAI_Prediction/migrations/EnrichmentFetchIndexes.sql), so there are no key lookups.
+# Built once; the row limit is a parameter so the text (and its plan handle) never changes.
+PEOPLE_QUERY = """
+SELECT TOP (?)
+    mi.Id,
+    mi.FullName,
+    mi.Surname,
+    g.Description AS Gender,
+    l.Description AS Language
+FROM
+    dbo.MasterItems AS mi
+OUTER APPLY
+    (SELECT TOP 1 Description FROM dbo.Genders WHERE MasterItemId = mi.Id) AS g
+OUTER APPLY
+    (SELECT TOP 1 Description FROM dbo.Languages WHERE MasterItemId = mi.Id) AS l
+ORDER BY
+    mi.Id ASC
+"""
+PEOPLE_LIMIT = 1001
+
+# One lightweight record per row, in the query's column order
+Person = namedtuple('Person', 'id full_name surname gender language')
+# Output line for one Person, filled positionally so no per-field attribute lookups are needed
+PERSON_LINE = "ID: {}, Full Name: {}, Surname: {}, Gender: {}, Language: {}\n"
+
 def fetch_first_20_people(conn):
     """
     Retrieves the first 20 people's ID, full name, surname, gender, and language
     from the 'dbo.MasterItems' table by joining with dbo.Genders and dbo.Languages.
+    Generator: yields one Person per row as each fetchmany() batch arrives.
+    The connection has MARS enabled, so the caller may run other queries on it while iterating.
+    Runs on the connection's cached statement_cursor(): finish (or drop) one iteration before
+    starting another on the same connection.
     """
     if not conn:
         print("No active database connection to fetch data.")
-        return []
+        return
 
-    cursor = conn.cursor()
-    people_data = []
+    cursor = statement_cursor(conn)
+    fetched_count = 0
     try:
-        # SQL query to select Id, FullName, Surname, Gender (from dbo.Genders), and Language (from dbo.Languages)
-        # using LEFT JOINs to include gender and language descriptions.
-        query = """
-        SELECT TOP 1001
-            mi.Id,
-            mi.FullName,
-            mi.Surname,
-            g.Description AS Gender,
-            l.Description AS Language
-        FROM
-            dbo.MasterItems AS mi
-        LEFT JOIN
-            dbo.Genders AS g ON mi.Id = g.MasterItemId
-        LEFT JOIN
-            dbo.Languages AS l ON mi.Id = l.MasterItemId
-        ORDER BY
-            mi.Id ASC
-        """
-        cursor.execute(query)
-
-        # Fetch all the results
-        rows = cursor.fetchall()
-
-        if rows:
-            print("\nFetched Data (First 20 People):")
-            for row in rows:
-                # Access columns by index (0 for Id, 1 for FullName, 2 for Surname, 3 for Gender, 4 for Language)
-                person_id, full_name, surname, gender, language = row
-                people_data.append({
-                    'id': person_id,
-                    'full_name': full_name,
-                    'surname': surname,
-                    'gender': gender,
-                    'language': language
-                })
-                print(f"ID: {person_id}, Full Name: {full_name}, Surname: {surname}, Gender: {gender}, Language: {language}")
-        else:
+        # TOP (?) is bound as an integer so the server reuses one cached plan across calls
+        cursor.setinputsizes([(pyodbc.SQL_INTEGER, 0, 0)])
+        cursor.execute(PEOPLE_QUERY, PEOPLE_LIMIT)
+
+        # Fetch the results FETCH_ARRAYSIZE rows at a time
+        while rows := cursor.fetchmany():
+            if not fetched_count:
+                print("\nFetched Data (First 20 People):")
+            # Columns map by position (Id, FullName, Surname, Gender, Language)
+            batch = [Person._make(row) for row in rows]
+            # One write per fetched batch instead of a print() per row
+            sys.stdout.write("".join(PERSON_LINE.format(*person) for person in batch))
+            fetched_count += len(batch)
+            yield from batch
+        if not fetched_count:
             print("No data found in the 'dbo.MasterItems' table.")
 
     except pyodbc.Error as ex:
         sqlstate = ex.args[0]
         print(f"Error fetching data: {sqlstate}. Details: {ex}")
-    finally:
-        cursor.close() # Always close the cursor
+    # The cursor stays open for reuse; any rows left by a consumer that stopped early are
+    # discarded by its next execute (or when the connection is closed).
 
-    return people_data
+def fetch_first_people_frame(conn):
+    """
+    Same rows as fetch_first_20_people, as a pandas DataFrame with columns named like Person's fields.
+    pandas reads the cursor in FETCH_ARRAYSIZE-row chunks straight into columns, so no per-row
+    Python objects are kept. Requires pandas.
+    """
+    if pd is None:
+        raise RuntimeError("pandas is not installed; run 'pip install pandas' to use fetch_first_people_frame().")
+    chunks = pd.read_sql(PEOPLE_QUERY, conn, params=[PEOPLE_LIMIT], chunksize=FETCH_ARRAYSIZE)
+    frame = pd.concat(chunks, ignore_index=True)
+    frame.columns = Person._fields
+    return frame
 
 if __name__ == "__main__":
-    # 1. Get a database connection
-    connection = get_db_connection()
+    # 1. Borrow a database connection from the pool
+    with acquire() as connection:
+        if connection:
+            # 2. Fetch the first 20 people, handling each one as it is streamed in
+            # (consume the generator inside this block - the connection goes back to the pool on exit)
+            fetched_count = 0
+            for person in fetch_first_20_people(connection):
+                fetched_count += 1
 
-    if connection:
-        # 2. Fetch the first 20 people
-        fetched_people = fetch_first_20_people(connection)
-
-        # You can now work with 'fetched_people' list, for example:
-        # print("\nTotal records fetched:", len(fetched_people))
+            # print("\nTotal records fetched:", fetched_count)
+        else:
+            print("Could not establish a database connection. Please check DB_CONFIG and ODBC driver.")
 
-        # 3. Close the database connection when done
-        connection.close()
+    # 3. Close the pooled connections when done
+    if not _pool.empty():
+        close_pool()
         print("\nDatabase connection closed.")
-    else:
-        print("Could not establish a database connection. Please check DB_CONFIG and ODBC driver.")
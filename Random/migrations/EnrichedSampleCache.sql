@@ -0,0 +1,73 @@
+-- dbo.EnrichedSampleCache / dbo.usp_RefreshEnrichedSample
+-- A stored random sample of fully enriched people. The refresh procedure draws a new sample and
+-- swaps it in; Random/random_data_sampler.py just reads the table, so the NEWID() sort is off
+-- the spot-check path. The procedure also returns the new sample, so the script calls it
+-- directly (and writes the cache) only when the cache is empty.
+-- Requires vEnrichedPeople.sql. Deploy: sqlcmd -S . -d sa_database_enrichment -i EnrichedSampleCache.sql
+-- The procedure reads the indexed view WITH (NOEXPAND), which needs QUOTED_IDENTIFIER / ANSI_NULLS ON
+-- when it is created; sqlcmd defaults the former to OFF.
+SET ANSI_NULLS ON;
+SET QUOTED_IDENTIFIER ON;
+GO
+
+IF OBJECT_ID('dbo.EnrichedSampleCache', 'U') IS NULL
+    CREATE TABLE dbo.EnrichedSampleCache (
+        Id        INT            NOT NULL PRIMARY KEY,
+        FullName  NVARCHAR(255)  NULL,
+        Surname   NVARCHAR(255)  NULL,
+        Gender    NVARCHAR(255)  NULL,
+        Language  NVARCHAR(255)  NULL,
+        SampledAt DATETIME2(0)   NOT NULL DEFAULT SYSUTCDATETIME()
+    );
+GO
+
+CREATE OR ALTER PROCEDURE dbo.usp_RefreshEnrichedSample
+    @SampleSize INT = 20
+AS
+BEGIN
+    SET NOCOUNT ON;
+    SET XACT_ABORT ON;
+
+    CREATE TABLE #sample (Id INT PRIMARY KEY, FullName NVARCHAR(255), Surname NVARCHAR(255),
+                          Gender NVARCHAR(255), Language NVARCHAR(255));
+
+    -- TABLESAMPLE cannot target a view: sample ~1% of MasterItems pages and seek each sampled Id
+    -- in the view, so NEWID() only orders the sampled rows.
+    INSERT INTO #sample (Id, FullName, Surname, Gender, Language)
+    SELECT TOP (@SampleSize) ep.Id, ep.FullName, ep.Surname, ep.Gender, ep.Language
+    FROM dbo.MasterItems AS mi TABLESAMPLE SYSTEM (1 PERCENT)
+    INNER JOIN dbo.vEnrichedPeople AS ep WITH (NOEXPAND) ON ep.Id = mi.Id
+    WHERE ep.HasFullName = 1
+    ORDER BY NEWID();
+
+    IF @@ROWCOUNT < @SampleSize
+    BEGIN
+        -- Small table or sparse enrichment: the page sample came back short, sort everything instead
+        TRUNCATE TABLE #sample;
+        INSERT INTO #sample (Id, FullName, Surname, Gender, Language)
+        SELECT TOP (@SampleSize) ep.Id, ep.FullName, ep.Surname, ep.Gender, ep.Language
+        FROM dbo.vEnrichedPeople AS ep WITH (NOEXPAND)
+        WHERE ep.HasFullName = 1
+        ORDER BY NEWID();
+    END
+
+    -- Swap in one transaction so readers never see an empty cache
+    BEGIN TRAN;
+    DELETE FROM dbo.EnrichedSampleCache;
+    INSERT INTO dbo.EnrichedSampleCache (Id, FullName, Surname, Gender, Language)
+    SELECT Id, FullName, Surname, Gender, Language FROM #sample;
+    COMMIT;
+
+    SELECT Id, FullName, Surname, Gender, Language FROM #sample ORDER BY Id;
+END
+GO
+
+-- Optional SQL Agent job refreshing the sample every 5 minutes (run once, in msdb):
+-- EXEC msdb.dbo.sp_add_job         @job_name = N'Refresh enriched sample';
+-- EXEC msdb.dbo.sp_add_jobstep     @job_name = N'Refresh enriched sample', @step_name = N'Refresh',
+--                                  @database_name = N'sa_database_enrichment',
+--                                  @command = N'EXEC dbo.usp_RefreshEnrichedSample;';
+-- EXEC msdb.dbo.sp_add_jobschedule @job_name = N'Refresh enriched sample', @name = N'Every 5 minutes',
+--                                  @freq_type = 4, @freq_interval = 1,
+--                                  @freq_subday_type = 4, @freq_subday_interval = 5;
+-- EXEC msdb.dbo.sp_add_jobserver   @job_name = N'Refresh enriched sample';
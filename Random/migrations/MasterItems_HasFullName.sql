@@ -0,0 +1,22 @@
+-- dbo.MasterItems.HasFullName
+-- Persisted "FullName present" flag, indexed as (flag, Id), so the FullName filter behind the
+-- spot-check sample (vEnrichedPeople.sql, EnrichedSampleCache.sql) is a seek instead of evaluating
+-- FullName on every row.
+-- (Filtered-index predicates cannot reference computed columns, hence the flag as index key.)
+-- A plain <> '' treats all-blank names as empty: trailing spaces are ignored when comparing.
+-- Deploy: sqlcmd -S . -d sa_database_enrichment -i MasterItems_HasFullName.sql
+-- An index on a computed column needs QUOTED_IDENTIFIER / ANSI_NULLS ON; sqlcmd defaults the former to OFF.
+SET ANSI_NULLS ON;
+SET QUOTED_IDENTIFIER ON;
+GO
+
+IF COL_LENGTH('dbo.MasterItems', 'HasFullName') IS NULL
+    ALTER TABLE dbo.MasterItems ADD HasFullName AS
+        (CASE WHEN FullName IS NOT NULL AND FullName <> '' THEN 1 ELSE 0 END) PERSISTED;
+GO
+
+IF NOT EXISTS (SELECT 1 FROM sys.indexes
+               WHERE name = 'IX_MasterItems_HasFullName' AND object_id = OBJECT_ID('dbo.MasterItems'))
+    CREATE NONCLUSTERED INDEX IX_MasterItems_HasFullName
+        ON dbo.MasterItems (HasFullName, Id) INCLUDE (FullName, Surname);
+GO
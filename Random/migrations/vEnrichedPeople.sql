@@ -0,0 +1,28 @@
+-- dbo.vEnrichedPeople
+-- Indexed (materialized) view of every fully enriched person: MasterItems joined to its
+-- Genders and Languages rows, one row per Id. dbo.usp_RefreshEnrichedSample (EnrichedSampleCache.sql)
+-- draws the spot-check sample from this one clustered index instead of joining three tables.
+-- Indexed views allow only INNER joins, so Random/fetch_enriched_people_data.py (OUTER APPLY,
+-- unenriched people included) keeps reading the base tables.
+-- The unique clustered index requires at most one Genders / Languages row per MasterItemId.
+-- Once the view is indexed, every INSERT into Genders / Languages needs QUOTED_IDENTIFIER and
+-- ANSI_NULLS ON (else Msg 1934). Redeploy OpenAI_Prediction/migrations/usp_UpsertPersonPredictions.sql
+-- (it sets both) if it was created before that header existed.
+-- Requires MasterItems_HasFullName.sql. Deploy: sqlcmd -S . -d sa_database_enrichment -i vEnrichedPeople.sql
+SET ANSI_NULLS ON;
+SET QUOTED_IDENTIFIER ON;
+GO
+
+IF OBJECT_ID('dbo.vEnrichedPeople', 'V') IS NULL
+    EXEC('CREATE VIEW dbo.vEnrichedPeople WITH SCHEMABINDING AS
+          SELECT mi.Id, mi.FullName, mi.Surname, mi.HasFullName,
+                 g.Description AS Gender, l.Description AS Language
+          FROM dbo.MasterItems AS mi
+          INNER JOIN dbo.Genders AS g ON g.MasterItemId = mi.Id
+          INNER JOIN dbo.Languages AS l ON l.MasterItemId = mi.Id;');
+GO
+
+IF NOT EXISTS (SELECT 1 FROM sys.indexes
+               WHERE name = 'IX_vEnrichedPeople' AND object_id = OBJECT_ID('dbo.vEnrichedPeople'))
+    CREATE UNIQUE CLUSTERED INDEX IX_vEnrichedPeople ON dbo.vEnrichedPeople (Id);
+GO
@@ -1,6 +1,10 @@
 import pyodbc
 import os # Import the os module to access environment variables
+import sys
 from dotenv import load_dotenv # Make sure this is imported
+import queue
+from collections import namedtuple
+from contextlib import contextmanager
 
 load_dotenv() # Load .env variables at the very beginning of the script
 
@@ -13,17 +17,25 @@ DB_CONFIG = {
     'database': 'sa_database_enrichment',        # Your database name
     'uid': 'KC',                                 # Your SQL Server login username
     'pwd': os.environ.get('DB_PASSWORD'),        # Fetched from DB_PASSWORD environment variable
-    'TrustServerCertificate': 'yes'              # Added based on 'Trust server certificate' being checked
+    'TrustServerCertificate': 'yes',             # Added based on 'Trust server certificate' being checked
+    'MARS_Connection': 'yes'                     # Lets other statements run while a streamed result is still open
 }
 
-# --- TEMPORARY DEBUG LINE ---
-# This will print the first few characters of the password to confirm it's being read.
-# REMOVE THIS LINE AFTER DEBUGGING FOR SECURITY!
-if DB_CONFIG['pwd']:
-    print(f"DEBUG: Password (first 5 chars from .env): {DB_CONFIG['pwd'][:5]}*****")
-else:
-    print("DEBUG: DB_PASSWORD environment variable is NOT set or loaded correctly in script.")
-# --- END TEMPORARY DEBUG LINE ---
+# Rows per fetchmany(); covers the whole TOP 20 sample in a single fetch
+FETCH_ARRAYSIZE = 1000
+
+SAMPLE_SIZE = 20   # rows bound to the query's TOP (?)
+
+# Connection string built once at import from DB_CONFIG; get_db_connection() reuses it
+CONN_STR = (
+    f"DRIVER={DB_CONFIG['driver']};"
+    f"SERVER={DB_CONFIG['server']};"
+    f"DATABASE={DB_CONFIG['database']};"
+    f"UID={DB_CONFIG['uid']};"
+    f"PWD={DB_CONFIG['pwd']};"
+    f"TrustServerCertificate={DB_CONFIG['TrustServerCertificate']};"
+    f"MARS_Connection={DB_CONFIG['MARS_Connection']};"
+)
 
 def get_db_connection():
     """
@@ -37,16 +49,13 @@ def get_db_connection():
             print("Error: 'DB_PASSWORD' environment variable is not set. Please set it in your .env file.")
             return None
 
-        # Construct the connection string from the DB_CONFIG dictionary
-        connection_string = (
-            f"DRIVER={DB_CONFIG['driver']};"
-            f"SERVER={DB_CONFIG['server']};"
-            f"DATABASE={DB_CONFIG['database']};"
-            f"UID={DB_CONFIG['uid']};"
-            f"PWD={DB_CONFIG['pwd']};"
-            f"TrustServerCertificate={DB_CONFIG['TrustServerCertificate']};"
-        )
-        conn = pyodbc.connect(connection_string)
+        # Autocommit: the cache read leaves no implicit transaction open, and the refresh call made
+        # when the cache is empty (it rewrites dbo.EnrichedSampleCache) commits on its own
+        conn = pyodbc.connect(CONN_STR, autocommit=True)
+        # NVARCHAR columns arrive from the SQL Server driver as UTF-16LE; pinning that codec keeps pyodbc
+        # on its built-in UTF-16 decoder for every name / description (UTF-8 here would garble them)
+        conn.setdecoding(pyodbc.SQL_WCHAR, encoding='utf-16le')
+        conn.setencoding(encoding='utf-16le')
         print("Successfully connected to the database!")
         return conn
     except pyodbc.Error as ex:
@@ -56,6 +65,95 @@ def get_db_connection():
         print("and the ODBC driver is installed and correctly named.")
         return None
 
+# --- Connection pool ---
+# Connections are borrowed with acquire() and handed back instead of closed, so a caller that
+# runs these helpers repeatedly (a web handler, a batch job) pays the login handshake once.
+POOL_MAX_SIZE = 20
+_pool = queue.LifoQueue(maxsize=POOL_MAX_SIZE)
+# One long-lived cursor per pooled connection. pyodbc skips SQLPrepare when a cursor re-executes the
+# SQL text it ran last, so repeat calls reuse the prepared statement instead of preparing it again.
+_cursors = {}
+
+def statement_cursor(conn):
+    """Returns conn's cached cursor, creating it (with FETCH_ARRAYSIZE) on first use."""
+    cursor = _cursors.get(conn)
+    if cursor is None:
+        cursor = _cursors[conn] = conn.cursor()
+        cursor.arraysize = FETCH_ARRAYSIZE
+    return cursor
+
+def discard_connection(conn):
+    """Forgets conn's cached cursor and closes the connection (which closes the cursor too)."""
+    _cursors.pop(conn, None)
+    try:
+        conn.close()
+    except pyodbc.Error:
+        pass
+
+def ensure_connection(conn):
+    # Reuse conn while it still answers a trivial probe; otherwise replace it (None on failure).
+    if conn is not None:
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return conn
+        except pyodbc.Error as ex:
+            print(f"Database connection lost ({ex}); reconnecting...")
+            discard_connection(conn)
+    return get_db_connection()
+
+@contextmanager
+def acquire():
+    """
+    Yields an idle pooled connection, or a new one from get_db_connection() (None if that fails).
+    An idle connection is checked with a SELECT 1 first and replaced if the server dropped it.
+    The connection goes back to the pool on exit; it is closed if the pool is already full.
+    """
+    try:
+        conn = _pool.get_nowait()
+    except queue.Empty:
+        conn = None
+    conn = ensure_connection(conn)
+    try:
+        yield conn
+    finally:
+        if conn is not None:
+            try:
+                _pool.put_nowait(conn)
+            except queue.Full:
+                discard_connection(conn)
+
+def close_pool():
+    """Closes every idle pooled connection."""
+    while True:
+        try:
+            discard_connection(_pool.get_nowait())
+        except queue.Empty:
+            break
+
+# The random sample of people that have FullName, Gender, and Language allocated is drawn server-side
+# by dbo.usp_RefreshEnrichedSample (migrations/EnrichedSampleCache.sql, ideally on a SQL Agent schedule)
+# and stored in dbo.EnrichedSampleCache, so a spot check is a plain read of a handful of rows.
+# The row count is a parameter so the text (and its plan handle) never changes.
+CACHED_SAMPLE_QUERY = """
+SELECT TOP (?)
+    Id,
+    FullName,
+    Surname,
+    Gender,
+    Language
+FROM
+    dbo.EnrichedSampleCache
+ORDER BY
+    Id
+"""
+# Draws a fresh sample into the cache (a write) and returns it; used only when the cache is empty
+REFRESH_SAMPLE_CALL = "{CALL dbo.usp_RefreshEnrichedSample(?)}"
+
+# One lightweight record per row, in the query's column order
+Person = namedtuple('Person', 'id full_name surname gender language')
+# Output line for one Person, filled positionally so no per-field attribute lookups are needed
+PERSON_LINE = "ID: {}, Full Name: {}, Surname: {}, Gender: {}, Language: {}\n"
+
 def fetch_random_20_enriched_people_sample(conn): # Renamed for clarity
     """
     Retrieves a random set of 20 people who have a non-empty FullName,
@@ -66,81 +164,53 @@ def fetch_random_20_enriched_people_sample(conn): # Renamed for clarity
         print("No active database connection to fetch data.")
         return []
 
-    cursor = None # Initialize cursor to None
     people_data = []
     try:
-        cursor = conn.cursor() # Create cursor inside try
-        # SQL query to select a random TOP 20 set of records
-        # that have FullName, Gender, and Language allocated.
-        query = """
-        SELECT TOP 20
-            mi.Id,
-            mi.FullName,
-            mi.Surname,
-            g.Description AS Gender,
-            l.Description AS Language
-        FROM
-            dbo.MasterItems AS mi
-        INNER JOIN  -- Ensures a matching record exists in Genders
-            dbo.Genders AS g ON mi.Id = g.MasterItemId
-        INNER JOIN  -- Ensures a matching record exists in Languages
-            dbo.Languages AS l ON mi.Id = l.MasterItemId
-        WHERE
-            mi.FullName IS NOT NULL AND LTRIM(RTRIM(mi.FullName)) <> '' -- Ensures FullName is not NULL and not effectively empty
-            -- Optional: If you also want to ensure that the Description fields themselves in Genders/Languages are not empty/null:
-            -- AND g.Description IS NOT NULL AND LTRIM(RTRIM(g.Description)) <> ''
-            -- AND l.Description IS NOT NULL AND LTRIM(RTRIM(l.Description)) <> ''
-        ORDER BY
-            NEWID()  -- This will order the rows randomly before picking the TOP 20
-        """
-        cursor.execute(query)
-
-        rows = cursor.fetchall()
-
-        if rows:
+        cursor = statement_cursor(conn) # Cached per connection; not closed here
+        # TOP (?) is bound as an integer so the server reuses one cached plan per query text
+        cursor.setinputsizes([(pyodbc.SQL_INTEGER, 0, 0)])
+        rows = cursor.execute(CACHED_SAMPLE_QUERY, SAMPLE_SIZE).fetchmany()
+        if not rows:
+            # Cache empty (refresh job not run yet): draw a sample now; a short cache is served as is
+            rows = cursor.execute(REFRESH_SAMPLE_CALL, SAMPLE_SIZE).fetchmany()
+
+        # Columns map by position (Id, FullName, Surname, Gender, Language)
+        people_data = [Person._make(row) for row in rows]
+        if people_data:
             print("\nFetched Random Sample of Enriched Data (20 People):")
-            for row in rows:
-                person_id, full_name, surname, gender, language = row
-                people_data.append({
-                    'id': person_id,
-                    'full_name': full_name,
-                    'surname': surname,
-                    'gender': gender,
-                    'language': language
-                })
-                # With INNER JOINs, gender and language should ideally not be None from the query itself,
+            lines = []
+            for person_id, full_name, surname, gender, language in people_data:
+                # The sample only holds people with both rows, so gender and language should ideally not be None,
                 # but keeping the display handling is safe.
                 gender_display = gender if gender is not None else "Error:Gender_NULL_Unexpected"
                 language_display = language if language is not None else "Error:Language_NULL_Unexpected"
-                print(f"ID: {person_id}, Full Name: {full_name}, Surname: {surname}, Gender: {gender_display}, Language: {language_display}")
-        else:
+                lines.append(PERSON_LINE.format(person_id, full_name, surname, gender_display, language_display))
+            sys.stdout.write("".join(lines))  # one write for the whole sample
+        if not people_data:
             print("No data found matching the criteria (FullName, Gender, and Language allocated).")
             print("This could mean no records are fully enriched yet, or none also meet the FullName criteria.")
 
     except pyodbc.Error as ex:
         sqlstate = ex.args[0]
         print(f"Error fetching data: {sqlstate}. Details: {ex}")
-    finally:
-        if cursor: # Ensure cursor exists before trying to close
-            cursor.close() # Always close the cursor
 
     return people_data
 
 if __name__ == "__main__":
-    # 1. Get a database connection
-    connection = get_db_connection()
+    # 1. Borrow a database connection from the pool
+    with acquire() as connection:
+        if connection:
+            # 2. Fetch a random sample of 20 fully enriched people
+            fetched_people = fetch_random_20_enriched_people_sample(connection) # Updated function name
 
-    if connection:
-        # 2. Fetch a random sample of 20 fully enriched people
-        fetched_people = fetch_random_20_enriched_people_sample(connection) # Updated function name
-
-        if fetched_people:
-            print(f"\nTotal random enriched records fetched for spot check: {len(fetched_people)}")
+            if fetched_people:
+                print(f"\nTotal random enriched records fetched for spot check: {len(fetched_people)}")
+            else:
+                print("\nNo fully enriched records were fetched for the spot check.")
         else:
-            print("\nNo fully enriched records were fetched for the spot check.")
-            
-        # 3. Close the database connection when done
-        connection.close()
-        print("\nDatabase connection closed.")
-    else:
-        print("Could not establish a database connection. Please check DB_CONFIG, .env file, and ODBC driver.")
\ No newline at end of file
+            print("Could not establish a database connection. Please check DB_CONFIG, .env file, and ODBC driver.")
+
+    # 3. Close the pooled connections when done
+    if not _pool.empty():
+        close_pool()
+        print("\nDatabase connection closed.")
\ No newline at end of file
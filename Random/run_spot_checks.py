@@ -0,0 +1,60 @@
+import sys
+
+import pyodbc
+
+# Both spot-check scripts live next to this one; run it from this folder (python run_spot_checks.py)
+import fetch_enriched_people_data as first_people
+import random_data_sampler as random_sample
+
+def fetch_many_sets(conn, statements):
+    """
+    Sends every (sql, params) statement to the server as one batch - a single round trip -
+    and returns one row list per statement, read in order with nextset().
+    """
+    params = [value for _, statement_params in statements for value in statement_params]
+    cursor = conn.cursor()
+    try:
+        cursor.execute(";\n".join(sql for sql, _ in statements), *params)
+        results = [cursor.fetchall()]
+        while cursor.nextset():
+            results.append(cursor.fetchall())
+        return results
+    finally:
+        cursor.close()
+
+def write_people(title, people):
+    """Prints a header and one line per Person in a single stdout write."""
+    sys.stdout.write(f"\n{title}\n" + "".join(first_people.PERSON_LINE.format(*person) for person in people))
+
+def run_spot_checks(conn):
+    """
+    Runs the first-people fetch and the random enriched sample in one batch on one connection,
+    so both results come back in a single round trip. Returns (first_people, sampled_people).
+    """
+    first_rows, sampled_rows = fetch_many_sets(conn, [
+        (first_people.PEOPLE_QUERY, [first_people.PEOPLE_LIMIT]),
+        (random_sample.CACHED_SAMPLE_QUERY, [random_sample.SAMPLE_SIZE]),
+    ])
+    if not sampled_rows:
+        # Cache empty (refresh job not run yet): draw a sample now; a short cache is served as is
+        (sampled_rows,) = fetch_many_sets(conn, [(random_sample.REFRESH_SAMPLE_CALL, [random_sample.SAMPLE_SIZE])])
+    return ([first_people.Person._make(row) for row in first_rows],
+            [random_sample.Person._make(row) for row in sampled_rows])
+
+if __name__ == "__main__":
+    try:
+        with first_people.acquire() as connection:
+            if connection:
+                fetched_people, sampled_people = run_spot_checks(connection)
+                write_people("Fetched Data (First People):", fetched_people)
+                write_people("Fetched Random Sample of Enriched Data:", sampled_people)
+                print(f"\nFirst people fetched: {len(fetched_people)}, random enriched records sampled: {len(sampled_people)}")
+            else:
+                print("Could not establish a database connection. Please check DB_CONFIG, .env file, and ODBC driver.")
+    except pyodbc.Error as ex:
+        sqlstate = ex.args[0]
+        print(f"Error fetching data: {sqlstate}. Details: {ex}")
+    finally:
+        # Close the pooled connection when done
+        first_people.close_pool()
+        print("\nDatabase connection closed.")
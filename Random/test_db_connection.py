@@ -16,15 +16,6 @@ DB_CONFIG = {
     'TrustServerCertificate': 'yes'             # Added based on 'Trust server certificate' being checked
 }
 
-# --- TEMPORARY DEBUG LINE ---
-# This will print the first few characters of the password to confirm it's being read.
-# REMOVE THIS LINE AFTER DEBUGGING FOR SECURITY!
-if DB_CONFIG['pwd']:
-    print(f"DEBUG: Password (first 5 chars from .env): {DB_CONFIG['pwd'][:5]}*****")
-else:
-    print("DEBUG: DB_PASSWORD environment variable is NOT set or loaded correctly in script.")
-# --- END TEMPORARY DEBUG LINE ---
-
 def get_db_connection():
     """
     Establishes and returns a pyodbc connection to the SQL Server database.
@@ -54,17 +54,17 @@ def count_records_missing_both_gender_and_language():
     count = 0
     try:
         cursor = conn.cursor()
-        # SQL query to count records missing entries in BOTH Genders and Languages tables
+        # SQL query to count records missing entries in BOTH Genders and Languages tables.
+        # NOT EXISTS lets SQL Server probe IX_Genders_MasterItemId / IX_Languages_MasterItemId
+        # (OpenAI_Prediction/migrations/EnrichmentFetchIndexes.sql) per item as an anti-semi-join
+        # instead of building both outer joins and filtering afterwards.
         query = """
-            SELECT COUNT(mi.Id) AS MissingBothCount
+            SELECT COUNT_BIG(*) AS MissingBothCount
             FROM
                 dbo.MasterItems AS mi
-            LEFT JOIN
-                dbo.Genders AS g ON mi.Id = g.MasterItemId
-            LEFT JOIN
-                dbo.Languages AS l ON mi.Id = l.MasterItemId
             WHERE
-                g.MasterItemId IS NULL AND l.MasterItemId IS NULL;
+                NOT EXISTS (SELECT 1 FROM dbo.Genders AS g WHERE g.MasterItemId = mi.Id)
+                AND NOT EXISTS (SELECT 1 FROM dbo.Languages AS l WHERE l.MasterItemId = mi.Id);
         """
         
         print("\nExecuting query to count records missing both gender and language...")